@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of compose, composition tags and define against their include and
+inclusion_tag equivalents.
+
+Usage: python benchmarks/run.py [--number N] [case ...]
+
+Each case reports renders per second and the peak memory allocated by one render.
+"""
+import argparse
+import os
+import sys
+import timeit
+import tracemalloc
+
+import django
+from django.conf import settings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+settings.configure(
+    INSTALLED_APPS=("compose_tags",),
+    TEMPLATES=[{"BACKEND": "django.template.backends.django.DjangoTemplates"}],
+)
+django.setup()
+
+from django.template import Context, Engine, Library  # noqa: E402
+
+from compose_tags import composition_tag  # noqa: E402
+
+DEPTH = 20
+WIDTH = 500
+
+register = Library()
+
+
+@register.inclusion_tag("button.html")
+def inclusion_button(children, disabled=False):
+    return {"children": children, "disabled": disabled}
+
+
+@register.tag
+@composition_tag("button.html")
+def button(children, disabled=False):
+    return {"children": children, "disabled": disabled}
+
+
+def nested(tag, depth):
+    if depth == 0:
+        return "{{ value }}"
+    return tag.format(body=nested(tag, depth - 1))
+
+
+TEMPLATES = {
+    "button.html": "<button{% if disabled %} disabled{% endif %}>{{ children }}</button>",
+    "card.html": "<article>{{ children }}</article>",
+    "included_card.html": "<article>{{ children }}</article>",
+    "context.html": "<p>{{ value }}{{ children }}</p>",
+    "deep_compose.html": nested(
+        '{{% compose "card.html" %}}{body}{{% endcompose %}}', DEPTH
+    ),
+    "deep_include.html": nested(
+        "{{% define children %}}{body}{{% enddefine %}}"
+        '{{% include "included_card.html" with children=children only %}}',
+        DEPTH,
+    ),
+    "wide_composition.html": (
+        "{% for item in items %}"
+        "{% button disabled=item %}{{ item }}{% endbutton %}"
+        "{% endfor %}"
+    ),
+    "wide_inclusion.html": (
+        "{% for item in items %}"
+        "{% define children %}{{ item }}{% enddefine %}"
+        "{% inclusion_button children disabled=item %}"
+        "{% endfor %}"
+    ),
+    "wide_takes_context.html": (
+        "{% for item in items %}"
+        '{% compose "context.html" takes_context %}{{ item }}{% endcompose %}'
+        "{% endfor %}"
+    ),
+    "wide_isolated.html": (
+        "{% for item in items %}"
+        '{% compose "context.html" value=value %}{{ item }}{% endcompose %}'
+        "{% endfor %}"
+    ),
+    "wide_literal.html": (
+        "{% for item in items %}"
+        '{% compose "card.html" %}{{ item }}{% endcompose %}'
+        "{% endfor %}"
+    ),
+    "wide_dynamic.html": (
+        "{% for item in items %}"
+        "{% compose template_name %}{{ item }}{% endcompose %}"
+        "{% endfor %}"
+    ),
+    "wide_include.html": (
+        "{% for item in items %}"
+        "{% define children %}{{ item }}{% enddefine %}"
+        '{% include "included_card.html" with children=children only %}'
+        "{% endfor %}"
+    ),
+}
+
+CASES = {
+    "deep_compose": ("deep_compose.html", "deep_include.html"),
+    "wide_composition": ("wide_composition.html", "wide_inclusion.html"),
+    "takes_context": ("wide_takes_context.html", "wide_include.html"),
+    "isolated": ("wide_isolated.html", "wide_include.html"),
+    "literal_name": ("wide_literal.html", "wide_include.html"),
+    "dynamic_name": ("wide_dynamic.html", "wide_include.html"),
+}
+
+CONTEXT = {
+    "value": "value",
+    "items": list(range(WIDTH)),
+    "template_name": "card.html",
+}
+
+
+def get_engine():
+    engine = Engine(
+        loaders=[
+            (
+                "django.template.loaders.cached.Loader",
+                [("django.template.loaders.locmem.Loader", TEMPLATES)],
+            )
+        ],
+        builtins=["compose_tags.templatetags.compose"],
+    )
+    engine.template_builtins.append(register)
+    return engine
+
+
+def measure(template, number):
+    def render():
+        return template.render(Context(CONTEXT))
+
+    render()  # Warm up the caches
+    seconds = min(timeit.repeat(render, number=number, repeat=3))
+    tracemalloc.start()
+    render()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return number / seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "cases", nargs="*", metavar="case", help="among: %s" % ", ".join(CASES)
+    )
+    parser.add_argument("--number", type=int, default=20, help="renders per run")
+    options = parser.parse_args()
+    unknown = set(options.cases) - set(CASES)
+    if unknown:
+        parser.error("unknown cases: %s" % ", ".join(sorted(unknown)))
+
+    engine = get_engine()
+    row = "{:<18} {:<24} {:>12} {:>12}"
+    print(row.format("case", "template", "renders/s", "peak KiB"))
+    for case in options.cases or CASES:
+        for template_name in CASES[case]:
+            template = engine.get_template(template_name)
+            renders, peak = measure(template, options.number)
+            print(
+                row.format(
+                    case, template_name, "%.1f" % renders, "%.1f" % (peak / 1024)
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Static analysis of the variables read by composed templates.
+
+A composed template rendered isolated only sees the values it is given: the root
+names of the variables its nodes reference are known at compile time. Compose nodes
+use them to skip resolving the keyword arguments their template never reads, and
+log on the "compose_tags.analysis" logger, when they first select their template:
+- a warning for the arguments passed but never read,
+- an info for the variables read but never passed, often optional values.
+
+Templates whose nodes can read any variable are not analyzed: `{% extends %}`,
+`{% include %}` without `only`, `{% debug %}`, tags taking the context and tags of
+third-party libraries.
+"""
+import logging
+
+from django.template import Node, NodeList, defaulttags
+from django.template.base import FilterExpression, Token, TokenType, Variable
+from django.template.library import InclusionNode
+from django.template.loader_tags import BlockNode, ExtendsNode, IncludeNode
+from django.template.smartif import TokenBase
+from django.templatetags.i18n import BlockTranslateNode
+
+from compose_tags.streaming import get_output_name
+
+logger = logging.getLogger("compose_tags.analysis")
+
+# Modules of the nodes that only read variables through their expressions.
+KNOWN_NODE_MODULES = ("django.template", "django.templatetags", "compose_tags")
+OPEN_NODES = (defaulttags.DebugNode, ExtendsNode)
+# Attributes of the nodes holding the names of the variables they set.
+BOUND_ATTRS = (
+    "asvar",
+    "countervar",
+    "loopvars",
+    "target_var",
+    "var_name",
+    "variable",
+    "variable_name",
+    "varname",
+)
+# Variables set by the nodes themselves.
+NODE_VARIABLES = {
+    BlockNode: "block",
+    defaulttags.FilterNode: "var",
+    defaulttags.ForNode: "forloop",
+}
+# Variables of every isolated context: its builtins, and those compose_tags passes.
+PROVIDED = frozenset(("True", "False", "None", "children", "csrf_token"))
+
+
+class TemplateVariables:
+    """
+    Root names of the variables a template reads, of those it sets itself, and of
+    those it only outputs as `{{ name }}`: their values can be rendered lazily.
+    Of the latter, unconditional are those output at the top level of the
+    template, on each of its renders.
+    """
+
+    def __init__(self, used, bound, lazy=(), unconditional=()):
+        self.used = frozenset(used)
+        self.bound = frozenset(bound)
+        self.lazy = frozenset(lazy)
+        self.conditional = self.lazy - frozenset(unconditional)
+
+    def __repr__(self):
+        return "<%s: used=%s bound=%s>" % (
+            self.__class__.__name__,
+            sorted(self.used),
+            sorted(self.bound),
+        )
+
+    def get_missing(self, passed):
+        """The variables read but neither passed nor set by the template."""
+        return self.used - self.bound - PROVIDED - set(passed)
+
+
+def is_open(node):
+    """Whether node may read variables of the context that none of its expressions name."""
+    if isinstance(node, OPEN_NODES) or getattr(node, "takes_context", False):
+        return True
+    if isinstance(node, IncludeNode):
+        return not node.isolated_context
+    return not node.__class__.__module__.startswith(KNOWN_NODE_MODULES)
+
+
+def iter_variable_names(value):
+    """Root names of the variables referenced by value, a node attribute."""
+    if isinstance(value, FilterExpression):
+        yield from iter_variable_names(value.var)
+        for _, args in value.filters:
+            for lookup, arg in args:
+                if lookup:
+                    yield from iter_variable_names(arg)
+    elif isinstance(value, Variable):
+        if value.lookups is not None:
+            yield value.lookups[0]
+    elif isinstance(value, Token):
+        # Variables of {% blocktranslate %}.
+        if value.token_type == TokenType.VAR:
+            yield value.contents.strip()
+    elif isinstance(value, TokenBase):
+        # Conditions of {% if %}.
+        for attr in ("first", "second", "value"):
+            yield from iter_variable_names(getattr(value, attr, None))
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from iter_variable_names(item)
+    elif isinstance(value, (list, tuple)) and not isinstance(value, NodeList):
+        for item in value:
+            yield from iter_variable_names(item)
+
+
+def iter_bound_names(node, node_variables):
+    for attr in BOUND_ATTRS:
+        names = getattr(node, attr, None)
+        if isinstance(names, str):
+            yield names
+        elif isinstance(names, (list, tuple)):
+            yield from names
+    if isinstance(node, (defaulttags.WithNode, BlockTranslateNode)):
+        yield from node.extra_context
+    for node_class, name in node_variables.items():
+        if isinstance(node, node_class):
+            yield name
+
+
+def get_csrf_nodes():
+    """Nodes reading the CSRF token without naming it: the tag, and nested templates."""
+    # compose_tags.node imports this module.
+    from compose_tags.node import ComposeNode
+
+    return (defaulttags.CsrfTokenNode, InclusionNode, ComposeNode)
+
+
+def get_node_variables():
+    """NODE_VARIABLES, and the variables set by compose_tags' own nodes."""
+    # compose_tags.node imports this module.
+    from compose_tags.node import DefineForNode
+
+    return {**NODE_VARIABLES, DefineForNode: "forloop"}
+
+
+def analyze_nodelist(nodelist):
+    """TemplateVariables of nodelist, or None if it may read any variable."""
+    csrf_nodes = get_csrf_nodes()
+    node_variables = get_node_variables()
+    used = set()
+    bound = set()
+    output = set()
+    for node in nodelist.get_nodes_by_type(Node):
+        if is_open(node):
+            return None
+        name = get_output_name(node)
+        if name is not None:
+            output.add(name)
+            continue
+        for attr, value in vars(node).items():
+            # The tag's own token holds the source of the node, not variables.
+            if attr not in ("token", "origin"):
+                used.update(iter_variable_names(value))
+        bound.update(iter_bound_names(node, node_variables))
+        if isinstance(node, csrf_nodes):
+            used.add("csrf_token")
+    lazy = output - used
+    unconditional = {get_output_name(node) for node in nodelist} & lazy
+    return TemplateVariables(used | output, bound, lazy, unconditional)
+
+
+def get_template_variables(template):
+    """TemplateVariables of template, analyzed once, or None if it may read any variable."""
+    try:
+        return template.compose_variables
+    except AttributeError:
+        template.compose_variables = analyze_nodelist(template.nodelist)
+        return template.compose_variables
+
+
+def reads_csrf_token(template):
+    """Whether template may output the CSRF token, as is or in nested templates."""
+    variables = get_template_variables(template)
+    return variables is None or "csrf_token" in variables.used
+
+
+def get_lazy_names(template, streaming=False):
+    """
+    Names of the values template only outputs, none if it may read any variable.
+    Rendering them lazily only pays off if template may not output them, unless
+    streaming: their chunks are then yielded as they are rendered.
+    """
+    variables = get_template_variables(template)
+    if variables is None:
+        return frozenset()
+    return variables.lazy if streaming else variables.conditional
+
+
+def get_location(node):
+    origin = getattr(node, "origin", None)
+    token = getattr(node, "token", None)
+    name = (origin.template_name or origin.name) if origin is not None else None
+    if token is None:
+        return str(name)
+    return "%s, line %d" % (name, token.lineno)
+
+
+def check_arguments(node, template, passed):
+    """
+    Return the names of passed that template reads, all of them if that is unknown.
+    Logs the arguments passed but never read, and the variables read but never passed.
+    """
+    variables = get_template_variables(template)
+    if variables is None:
+        return set(passed)
+    template_name = template.origin.template_name or template.origin.name
+    unused = set(passed) - variables.used
+    if unused:
+        logger.warning(
+            "%s passes %s to %s, which doesn't read them.",
+            get_location(node),
+            ", ".join(sorted(unused)),
+            template_name,
+        )
+    missing = variables.get_missing(passed)
+    if missing:
+        logger.info(
+            "%s reads %s, never passed by %s.",
+            template_name,
+            ", ".join(sorted(missing)),
+            get_location(node),
+        )
+    return set(passed) - unused
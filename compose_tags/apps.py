@@ -1,6 +1,33 @@
+import os
+import sys
+
 from django.apps import AppConfig
 
+# Scripts running management commands: manage.py, django-admin and python -m django.
+MANAGEMENT_SCRIPTS = ("manage.py", "django-admin", "django-admin.py", "__main__.py")
+
+
+def is_serving():
+    """
+    Whether this process serves requests: WSGI and ASGI servers, and the process
+    runserver's autoreloader restarts. Not other management commands, nor the
+    autoreloader's parent process, which never renders templates.
+    """
+    if os.path.basename(sys.argv[0]) not in MANAGEMENT_SCRIPTS:
+        return True
+    if sys.argv[1:2] != ["runserver"]:
+        return False
+    return os.environ.get("RUN_MAIN") == "true" or "--noreload" in sys.argv
+
 
 class ComposeTagsConfig(AppConfig):
     name = "compose_tags"
     verbose_name = "Django Compose Tags"
+
+    def ready(self):
+        from compose_tags.conf import compose_settings
+
+        if compose_settings.PRECOMPILE and is_serving():
+            from compose_tags.graph import precompile
+
+            precompile()
@@ -0,0 +1,104 @@
+"""
+Rendering of templates using composition tags decorated on `async def` functions.
+
+    async def view(request):
+        html = await arender(get_template("page.html"), {...}, request)
+        return HttpResponse(html)
+
+arender renders the template in a single worker thread, so the template can
+access the ORM. Sibling async composition tags, at the top level of a template,
+a composed template, children or slots, are awaited concurrently with a single
+trip to the event loop. Elsewhere, e.g. inside `{% if %}` or `{% for %}`, and
+with the regular render(), each async composition function is awaited on its own.
+"""
+import asyncio
+from contextvars import ContextVar
+from copy import copy
+
+from django.template import Context
+from django.template.context import make_context
+from django.test.signals import template_rendered
+from django.utils.safestring import SafeString
+
+_gathering = ContextVar("compose_tags_gathering", default=False)
+
+
+def is_gathering():
+    return _gathering.get()
+
+
+async def arender(template, context=None, request=None):
+    """Async equivalent of template.render(context, request)."""
+    from asgiref.sync import sync_to_async
+
+    return await sync_to_async(render_gathered)(template, context, request)
+
+
+def render_gathered(template, context=None, request=None):
+    """Render template, gathering sibling async composition tags."""
+    if hasattr(template, "backend"):
+        context = make_context(
+            context, request, autoescape=template.backend.engine.autoescape
+        )
+        template = template.template
+    elif not isinstance(context, Context):
+        context = Context(context)
+    token = _gathering.set(True)
+    try:
+        with context.render_context.push_state(template):
+            with context.bind_template(template):
+                context.template_name = template.name
+                template_rendered.send(
+                    sender=template, template=template, context=context
+                )
+                return render_nodelist(template.nodelist, context)
+    finally:
+        _gathering.reset(token)
+
+
+def gather_template(template, context):
+    """
+    Same as Template.render for a context already bound to a template, gathering
+    sibling async composition tags. Sends template_rendered like Django's test
+    instrumentation of Template._render does, for the test client's
+    response.templates and assertTemplateUsed.
+    """
+    with context.render_context.push_state(template):
+        template_rendered.send(sender=template, template=template, context=context)
+        return render_nodelist(template.nodelist, context)
+
+
+def render_nodelist(nodelist, context):
+    """
+    Same as NodeList.render, except that the functions of sibling async composition
+    tags are awaited concurrently, their templates being rendered afterwards.
+    """
+    parts = []
+    deferred = []
+    for node in nodelist:
+        if getattr(node, "is_async", False):
+            # Rendered after its following siblings: don't let them alter the
+            # context the composition sees.
+            coroutine, finish = node.prepare_async(freeze_context(context))
+            deferred.append((len(parts), coroutine, finish))
+            parts.append("")
+        else:
+            parts.append(node.render_annotated(context))
+    if deferred:
+        from asgiref.sync import async_to_sync
+
+        results = async_to_sync(gather)(*(coroutine for _, coroutine, _ in deferred))
+        for (index, _, finish), result in zip(deferred, results):
+            parts[index] = finish(result)
+    return SafeString("".join(parts))
+
+
+async def gather(*coroutines):
+    return await asyncio.gather(*coroutines)
+
+
+def freeze_context(context):
+    """Copy of context that later changes of context's layers don't affect."""
+    frozen = copy(context)
+    frozen.dicts = [dict(layer) for layer in context.dicts]
+    return frozen
@@ -0,0 +1,89 @@
+"""
+Render a component over many inputs from Python code, e.g. table rows of an export:
+
+    rows = render_many(row, ({"record": record} for record in records))
+    lines = iter_many("components/line.html", items, children="-")
+
+The component is a composition tag, or a template composed like with `{% compose %}`.
+The template is selected once and each item is rendered in the same context, its
+composed values replacing the previous item's: nodes keeping state in the render
+context, such as `{% cycle %}`, carry it over from an item to the next like in a
+`{% for %}` loop.
+"""
+from django.template import Context, NodeList, engines
+from django.utils.safestring import SafeString
+
+from compose_tags.graph import get_django_engines
+from compose_tags.keys import make_memo_key
+from compose_tags.node import CompositionNode, copy_csrf_token, default_composition
+
+
+def get_composition_node(tag_or_template):
+    """A CompositionNode without arguments, standing for tag_or_template."""
+    filename = getattr(tag_or_template, "composition_filename", None)
+    if filename is not None:
+        return CompositionNode(
+            tag_or_template.composition_func,
+            tag_or_template.composition_takes_context,
+            [],
+            {},
+            filename,
+            NodeList(),
+            memo=getattr(tag_or_template, "memo", None),
+        )
+    if isinstance(tag_or_template, (str, list, tuple)) or hasattr(
+        tag_or_template, "render"
+    ):
+        return CompositionNode(
+            default_composition, False, [], {}, tag_or_template, NodeList()
+        )
+    raise TypeError(
+        "%r is neither a composition tag nor a template." % (tag_or_template,)
+    )
+
+
+def iter_many(tag_or_template, items, children="", context=None, using=None):
+    """
+    Render tag_or_template once per keyword arguments dict of items, yielding the
+    output of each item.
+
+    children is the children of all items, or a callable returning the children
+    of an item from its keyword arguments. context is the context given to
+    composition functions taking the context, and its CSRF token is copied to
+    the composed templates. using is the alias of the Django templates engine
+    selecting the template, the first one by default.
+    """
+    node = get_composition_node(tag_or_template)
+    engine = engines[using].engine if using else get_django_engines()[0]
+    template = node.select_template(engine)
+    if not isinstance(context, Context):
+        context = Context(context, autoescape=engine.autoescape)
+    # Composed templates only see their values, as with render_isolated.
+    template_context = context.new({})
+    with template_context.render_context.push_state(template):
+        with template_context.bind_template(template):
+            template_context.template_name = template.name
+            nodelist = template.nodelist
+            for kwargs in items:
+                item_children = children(kwargs) if callable(children) else children
+                if node.takes_context:
+                    args = [item_children, context]
+                else:
+                    args = [item_children]
+                kwargs = dict(kwargs)
+                if node.memo is not None:
+                    values = node.call_memoized(
+                        args, kwargs, make_memo_key(args, kwargs)
+                    )
+                else:
+                    values = node.call(args, kwargs)
+                copy_csrf_token(context, values)
+                template_context.dicts[-1] = values
+                yield nodelist.render(template_context)
+
+
+def render_many(tag_or_template, items, children="", context=None, using=None):
+    """Render tag_or_template once per item of items, see iter_many, into a string."""
+    return SafeString(
+        "".join(iter_many(tag_or_template, items, children, context, using))
+    )
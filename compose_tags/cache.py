@@ -0,0 +1,93 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.core.cache import InvalidCacheBackendError, caches
+
+from compose_tags.conf import compose_settings
+
+
+class CacheStats:
+    """Thread-safe hit/miss counters, to check whether a cache pays off."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return "<%s: hits=%d misses=%d>" % (
+            self.__class__.__name__,
+            self.hits,
+            self.misses,
+        )
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+fragment_cache_stats = CacheStats()
+
+
+def md5():
+    try:
+        return hashlib.md5(usedforsecurity=False)
+    except TypeError:  # usedforsecurity was added in python 3.9
+        return hashlib.md5()
+
+
+def get_fragment_cache():
+    try:
+        return caches[compose_settings.CACHE]
+    except InvalidCacheBackendError:
+        return caches["default"]
+
+
+class LRUCache:
+    """Bounded, thread-safe, in process LRU cache, with hit/miss counters."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._values = OrderedDict()
+        self.stats = CacheStats()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key):
+        """Return the cached value, or None."""
+        with self._lock:
+            value = self._values.get(key)
+            if value is not None:
+                self._values.move_to_end(key)
+        if value is None:
+            self.stats.miss()
+        else:
+            self.stats.hit()
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._values[key] = value
+            while len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
@@ -0,0 +1,273 @@
+import logging
+import sys
+import threading
+from contextlib import contextmanager
+
+from django.utils.safestring import SafeData, SafeString
+
+from compose_tags.asynchronous import is_gathering, render_nodelist
+from compose_tags.conf import compose_settings
+from compose_tags.streaming import iter_nodelist
+
+logger = logging.getLogger("compose_tags.children")
+
+# Key of the render's ChildrenAllocations in the render context.
+CHILDREN_ALLOCATIONS_KEY = "compose_tags_children_allocations"
+
+
+class ChildrenBudgetExceeded(Exception):
+    pass
+
+
+class ChildrenAllocations:
+    """Size in bytes and number of the children strings built during a render."""
+
+    def __init__(self):
+        # Children may be rendered in parallel, see {% parallel %}.
+        self._lock = threading.Lock()
+        self.size = 0
+        self.count = 0
+        self.exceeded = False
+        # Read once per render, not on each of its children.
+        self.budget = compose_settings.CHILDREN_BUDGET
+        self.error = compose_settings.CHILDREN_BUDGET_ERROR
+
+    def __repr__(self):
+        return "<%s: size=%d count=%d>" % (
+            self.__class__.__name__,
+            self.size,
+            self.count,
+        )
+
+    def add(self, string):
+        with self._lock:
+            self.size += sys.getsizeof(string)
+            self.count += 1
+            size = self.size
+        if self.budget is not None and size > self.budget:
+            self.budget_exceeded(self.budget)
+
+    def budget_exceeded(self, budget):
+        message = (
+            "Children of the render allocated %d bytes, over the %d bytes budget"
+            % (
+                self.size,
+                budget,
+            )
+        )
+        if self.error:
+            raise ChildrenBudgetExceeded(message)
+        if not self.exceeded:
+            # Logged once per render.
+            self.exceeded = True
+            logger.warning(message)
+
+
+def get_children_allocations(context):
+    """Children allocations of the template render context belongs to."""
+    # The first render context layer is shared by the whole render, composed
+    # templates included.
+    render_state = context.render_context.dicts[0]
+    allocations = render_state.get(CHILDREN_ALLOCATIONS_KEY)
+    if allocations is None:
+        # Only built on the first use: setdefault's argument is built on each call.
+        allocations = render_state.setdefault(
+            CHILDREN_ALLOCATIONS_KEY, ChildrenAllocations()
+        )
+    return allocations
+
+
+def get_layers(context):
+    """Depth of the context and render context layers, see restore_layers."""
+    render_context = context.render_context
+    return len(context.dicts), len(render_context.dicts), render_context.template
+
+
+@contextmanager
+def restore_layers(context, layers):
+    """
+    Render with the layers of context as get_layers saw them, leaving out those
+    pushed on top since: cheaper than copying the context upfront.
+    """
+    render_context = context.render_context
+    if layers is None or layers == (
+        len(context.dicts),
+        len(render_context.dicts),
+        render_context.template,
+    ):
+        yield
+        return
+    depth, render_depth, template = layers
+    saved = context.dicts, render_context.dicts, render_context.template
+    context.dicts = context.dicts[:depth]
+    render_context.dicts = render_context.dicts[:render_depth]
+    render_context.template = template
+    try:
+        yield
+    finally:
+        context.dicts, render_context.dicts, render_context.template = saved
+
+
+def is_lazy_children(value):
+    """
+    Whether value is LazyChildren, without evaluating lazy objects as isinstance
+    would, e.g. the CSRF token of the context.
+    """
+    return issubclass(type(value), LazyChildren)
+
+
+class LazyChildren(SafeData):
+    """
+    Children of a composition, rendered on first use and memoized.
+
+    Passed to composed templates that only output it as `{{ children }}`, and
+    stored by `{% define ... lazy %}`: behaves as the rendered SafeString for
+    templates and most string usages, but isn't a str.
+    When streamed, the chunks are yielded as they are rendered and kept as a list,
+    only joined if the children are then used as a string.
+    The size of the joined strings is tracked in the render's ChildrenAllocations.
+
+    below_layers: render with the layers of context as they are now, without the
+    ones pushed on it in between, e.g. by a composed template taking the context.
+    """
+
+    def __init__(self, nodelist, context, below_layers=False):
+        self.nodelist = nodelist
+        self.context = context
+        self.layers = get_layers(context) if below_layers else None
+        # Set while profiling, see compose_tags.profiling.
+        self.timings = None
+        self._rendered = None
+        self._chunks = None
+
+    def __repr__(self):
+        return "<%s: %r>" % (self.__class__.__name__, self.nodelist)
+
+    def render(self):
+        if self._rendered is None:
+            if self._chunks is not None:
+                self._rendered = SafeString("".join(self._chunks))
+                get_children_allocations(self.context).add(self._rendered)
+            elif self.layers is None:
+                self._rendered = render_children(
+                    self.nodelist, self.context, self.timings
+                )
+            else:
+                with restore_layers(self.context, self.layers):
+                    self._rendered = render_children(
+                        self.nodelist, self.context, self.timings
+                    )
+        return self._rendered
+
+    def iter_chunks(self):
+        if self._rendered is not None:
+            yield self._rendered
+            return
+        if self._chunks is not None:
+            yield from self._chunks
+            return
+        chunks = []
+        with restore_layers(self.context, self.layers):
+            for chunk in iter_nodelist(self.nodelist, self.context):
+                chunks.append(chunk)
+                yield chunk
+        self._chunks = chunks
+
+    def __str__(self):
+        return self.render()
+
+    def __html__(self):
+        return self.render()
+
+    def __bool__(self):
+        return bool(self.render())
+
+    def __len__(self):
+        return len(self.render())
+
+    def __contains__(self, item):
+        return item in self.render()
+
+    def __eq__(self, other):
+        return self.render() == other
+
+    def __hash__(self):
+        return hash(self.render())
+
+    def __lt__(self, other):
+        return self.render() < other
+
+    def __le__(self, other):
+        return self.render() <= other
+
+    def __gt__(self, other):
+        return self.render() > other
+
+    def __ge__(self, other):
+        return self.render() >= other
+
+    def __getitem__(self, key):
+        return self.render()[key]
+
+    def __iter__(self):
+        return iter(self.render())
+
+    def __add__(self, other):
+        return self.render() + other
+
+    def __radd__(self, other):
+        return other + self.render()
+
+    def __mul__(self, other):
+        return self.render() * other
+
+    __rmul__ = __mul__
+
+    def __mod__(self, other):
+        return self.render() % other
+
+    def __format__(self, format_spec):
+        return format(self.render(), format_spec)
+
+    def __getattr__(self, attr):
+        # Delegate str methods (strip, split, ...) to the rendered children.
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        return getattr(self.render(), attr)
+
+
+def render_children(nodelist, context, timings=None):
+    """Render children, tracked in the render's ChildrenAllocations."""
+    if timings is None:
+        rendered = render_children_nodelist(nodelist, context)
+    else:
+        with timings.measure("children"):
+            rendered = render_children_nodelist(nodelist, context)
+    get_children_allocations(context).add(rendered)
+    return rendered
+
+
+def render_children_nodelist(nodelist, context):
+    if is_gathering():
+        return render_nodelist(nodelist, context)
+    return nodelist.render(context)
+
+
+def get_children(nodelist, context, lazy=True, below_layers=False, timings=None):
+    """
+    Children of a composition: LazyChildren, or rendered upfront when not lazy,
+    e.g. when the composed template outputs them on each render anyway.
+    """
+    if lazy:
+        return LazyChildren(nodelist, context, below_layers)
+    return render_children(nodelist, context, timings)
+
+
+def render_lazy_arguments(resolved_args, resolved_kwargs):
+    """Render the children and slots of the arguments in place."""
+    for i, value in enumerate(resolved_args):
+        if is_lazy_children(value):
+            resolved_args[i] = value.render()
+    for name, value in resolved_kwargs.items():
+        if is_lazy_children(value):
+            resolved_kwargs[name] = value.render()
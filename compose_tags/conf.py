@@ -0,0 +1,45 @@
+"""
+Settings for Django Compose Tags are all namespaced in the COMPOSE_TAGS setting:
+
+COMPOSE_TAGS = {
+    "CACHE": "template_fragments",
+}
+
+Settings are read on access so they can be overridden in tests.
+"""
+from django.conf import settings
+
+DEFAULTS = {
+    # Alias of the cache backend used by `{% compose ... cache=timeout %}`.
+    # Falls back to "default" when the alias isn't configured.
+    "CACHE": "template_fragments",
+    # Size of the thread pool rendering {% parallel %} blocks.
+    "PARALLEL_WORKERS": 4,
+    # Bytes of children strings a template render may build, None for no limit.
+    "CHILDREN_BUDGET": None,
+    # Raise ChildrenBudgetExceeded when the budget is exceeded, instead of logging
+    # a warning on the "compose_tags.children" logger.
+    "CHILDREN_BUDGET_ERROR": False,
+    # Collapse the whitespace of compose and composition children and of composed
+    # templates at compile time, see compose_tags.minify.
+    "MINIFY": False,
+    # Salt of the ETags of ComposeETagMiddleware, e.g. the deployed commit, for the
+    # output it can't see. Defaults to a digest of the sources of all templates.
+    "ETAG_SALT": None,
+    # Compile all templates when the server starts, see the compose_precompile
+    # command. Other management commands don't.
+    "PRECOMPILE": False,
+    # Directory of the templates compiled by compose_tags.loaders.PersistentLoader,
+    # required by the loader. Don't share it with other users: it stores pickles.
+    "COMPILED_TEMPLATES_DIR": None,
+}
+
+
+class ComposeTagsSettings:
+    def __getattr__(self, attr):
+        if attr not in DEFAULTS:
+            raise AttributeError("Invalid compose_tags setting: '%s'" % attr)
+        return getattr(settings, "COMPOSE_TAGS", {}).get(attr, DEFAULTS[attr])
+
+
+compose_settings = ComposeTagsSettings()
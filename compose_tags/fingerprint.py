@@ -0,0 +1,119 @@
+"""
+Fingerprint of the inputs of the compose and composition tags rendered, to derive
+HTTP cache validators from them, see compose_tags.middleware.ComposeETagMiddleware.
+
+Fingerprinting is active within `fingerprint()`:
+
+    with fingerprint() as page_fingerprint:
+        render_to_string("page.html")
+    page_fingerprint.hexdigest()
+
+Each composed template render adds the composed template's name and source, the
+values it receives, in render order, and its output environment: autoescape,
+localization, language and time zone settings, and the CSRF secret for templates
+outputting the token. Values are hashed by their stable representation, like the
+keys of `{% compose ... cache=timeout %}`: children and slots are rendered. A value
+without a stable representation, or a composition taking the context, makes the
+fingerprint unstable: it doesn't cover the output.
+"""
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from compose_tags.cache import md5
+from compose_tags.keys import get_output_environment, get_stable_repr
+
+_active_fingerprint = ContextVar("compose_tags_fingerprint", default=None)
+
+
+def get_active_fingerprint():
+    return _active_fingerprint.get()
+
+
+@contextmanager
+def fingerprint():
+    page_fingerprint = Fingerprint()
+    token = _active_fingerprint.set(page_fingerprint)
+    try:
+        yield page_fingerprint
+    finally:
+        _active_fingerprint.reset(token)
+
+
+def get_source_digest(template):
+    """Digest of the template's source, computed once per template."""
+    digest = getattr(template, "compose_source_digest", None)
+    if digest is None:
+        hasher = md5()
+        hasher.update(template.source.encode())
+        digest = template.compose_source_digest = hasher.digest()
+    return digest
+
+
+class Fingerprint:
+    def __init__(self):
+        self._hasher = md5()
+        # Components may be rendered in parallel, see {% parallel %}.
+        self._lock = threading.Lock()
+        self.components = 0
+        self.stable = True
+
+    def __repr__(self):
+        return "<%s: %s>" % (self.__class__.__name__, self.hexdigest())
+
+    def update(self, value):
+        """
+        Add a value the output depends on, e.g. from the view. See
+        compose_tags.keys.get_stable_repr for the values that can be added.
+        """
+        stable_value = get_stable_repr(value)
+        if stable_value is None:
+            self.set_unstable()
+            return
+        with self._lock:
+            self._hasher.update(b"\0")
+            self._hasher.update(stable_value.encode())
+
+    def set_unstable(self):
+        """The output depends on values the fingerprint can't cover."""
+        with self._lock:
+            self.stable = False
+
+    def add(self, template, values, environment):
+        parts = [
+            str(template.origin.name).encode(),
+            get_source_digest(template),
+            repr(environment).encode(),
+        ]
+        for name in sorted(values):
+            if name == "csrf_token":
+                continue
+            value = get_stable_repr(values[name])
+            if value is None:
+                self.set_unstable()
+                return
+            parts.append(("%s=%s" % (name, value)).encode())
+        with self._lock:
+            self.components += 1
+            self._hasher.update(b"\1")
+            self._hasher.update(b"\0".join(parts))
+
+    def hexdigest(self):
+        with self._lock:
+            return self._hasher.hexdigest()
+
+
+def add_fingerprint(template, values, context, takes_context=False):
+    """
+    Add a composed template render to the active fingerprint, if any. The whole
+    context of compositions taking it, request and user included, can't be
+    fingerprinted.
+    """
+    page_fingerprint = _active_fingerprint.get()
+    if page_fingerprint is not None:
+        if takes_context:
+            page_fingerprint.set_unstable()
+            return
+        page_fingerprint.add(
+            template, values, get_output_environment(context, template)
+        )
@@ -0,0 +1,205 @@
+"""
+Static dependency graph of composed templates, see the compose_precompile command.
+"""
+import os
+from collections import defaultdict
+
+from django.template import Template, TemplateDoesNotExist, TemplateSyntaxError
+from django.template.loaders.cached import Loader as CachedLoader
+
+from compose_tags.node import ComposeNode, CompositionNode
+
+
+class ComposeGraph:
+    """Templates compiled from a django.template.Engine and the templates they compose."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        # Template name -> names of the templates it composes.
+        self.edges = defaultdict(set)
+        # Template name -> number of compose usages with a dynamic target.
+        self.dynamic = defaultdict(int)
+        # Template name -> error raised while reading or compiling it.
+        self.errors = {}
+        self.templates = set()
+
+    def add_template(self, template_name):
+        if template_name in self.templates or template_name in self.errors:
+            return
+        try:
+            template = self.engine.get_template(template_name)
+        except (
+            TemplateDoesNotExist,
+            TemplateSyntaxError,
+            # Binary files and files that can't be read, found by the walk.
+            UnicodeDecodeError,
+            OSError,
+        ) as e:
+            self.errors[template_name] = e
+            return
+        self.templates.add(template_name)
+        for names in get_composed_names(template):
+            if names is None:
+                self.dynamic[template_name] += 1
+                continue
+            target = self.select_template_name(names)
+            self.edges[template_name].add(target)
+            self.add_template(target)
+
+    def select_template_name(self, names):
+        """The name select_template would pick among names, the first one by default."""
+        for name in names:
+            try:
+                self.engine.find_template(name)
+            except TemplateDoesNotExist:
+                continue
+            return name
+        return names[0]
+
+    @property
+    def components(self):
+        """Templates composed by another template."""
+        return {target for targets in self.edges.values() for target in targets}
+
+    def find_cycles(self):
+        cycles = []
+        visiting = []
+        done = set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                cycles.append(visiting[visiting.index(name) :] + [name])
+                return
+            visiting.append(name)
+            for target in sorted(self.edges.get(name, ())):
+                visit(target)
+            visiting.pop()
+            done.add(name)
+
+        for name in sorted(self.templates):
+            visit(name)
+        return cycles
+
+    def longest_chains(self, count=5):
+        """The deepest composition chains, cycles being cut."""
+        chains = {}
+
+        def chain(name, visiting):
+            if name in chains:
+                return chains[name]
+            longest = []
+            visiting = visiting | {name}
+            for target in self.edges.get(name, ()):
+                if target not in visiting:
+                    candidate = chain(target, visiting)
+                    if len(candidate) > len(longest):
+                        longest = candidate
+            chains[name] = [name] + longest
+            return chains[name]
+
+        for name in self.templates:
+            chain(name, frozenset())
+        return sorted(chains.values(), key=lambda chain: (-len(chain), chain))[:count]
+
+
+def get_composed_names(template):
+    """
+    Tuples of names of the templates composed by template, the first existing
+    one being used, or None for the dynamic targets. Relative names are already
+    resolved by the compose tag at compile time.
+    """
+    nodelist = template.nodelist
+    for node in nodelist.get_nodes_by_type(ComposeNode):
+        yield node.constant_template_name
+    for node in nodelist.get_nodes_by_type(CompositionNode):
+        if isinstance(node.filename, str):
+            yield (node.filename,)
+        elif not isinstance(node.filename, Template) and not hasattr(
+            node.filename, "template"
+        ):
+            yield tuple(node.filename)
+
+
+def get_composition_tags(engine):
+    """Composition tags available to the engine: {tag name: template name}."""
+    libraries = list(engine.template_builtins) + list(
+        engine.template_libraries.values()
+    )
+    return {
+        name: compile_func.composition_filename
+        for library in libraries
+        for name, compile_func in library.tags.items()
+        if isinstance(getattr(compile_func, "composition_filename", None), str)
+    }
+
+
+def iter_template_names(engine):
+    """Names of all the templates the engine's loaders can list."""
+    for loader in engine.template_loaders:
+        yield from iter_loader_template_names(loader)
+
+
+def iter_loader_template_names(loader):
+    if isinstance(loader, CachedLoader):
+        for child in loader.loaders:
+            yield from iter_loader_template_names(child)
+        return
+    templates = getattr(loader, "templates_dict", None)
+    if templates is not None:  # locmem loader
+        yield from templates
+        return
+    get_dirs = getattr(loader, "get_dirs", None)
+    if get_dirs is None:
+        return
+    for directory in get_dirs():
+        directory = str(directory)
+        for root, dirs, files in os.walk(directory):
+            # Skip hidden files and directories: VCS metadata, editors swap files...
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+            for filename in files:
+                if filename.startswith("."):
+                    continue
+                path = os.path.join(root, filename)
+                yield os.path.relpath(path, directory).replace(os.sep, "/")
+
+
+def iter_template_sources(engine):
+    """(origin name, source) of all the templates the engine's loaders can list."""
+    for loader in engine.template_loaders:
+        for template_name in sorted(set(iter_loader_template_names(loader))):
+            for origin in loader.get_template_sources(template_name):
+                try:
+                    yield origin.name, origin.loader.get_contents(origin)
+                except (TemplateDoesNotExist, UnicodeDecodeError, OSError):
+                    continue
+
+
+def build_graph(engine, template_names=None):
+    graph = ComposeGraph(engine)
+    if template_names is None:
+        template_names = iter_template_names(engine)
+    for template_name in sorted(set(template_names)):
+        graph.add_template(template_name)
+    return graph
+
+
+def get_django_engines():
+    """The django.template.Engine of each DjangoTemplates backend."""
+    from django.template import engines
+    from django.template.backends.django import DjangoTemplates
+
+    return [
+        backend.engine
+        for backend in engines.all()
+        if isinstance(backend, DjangoTemplates)
+    ]
+
+
+def precompile():
+    """
+    Compile all the templates of the Django engines, warming their cached loader.
+    Called at startup when the PRECOMPILE setting is enabled.
+    """
+    return [build_graph(engine) for engine in get_django_engines()]
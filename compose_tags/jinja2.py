@@ -0,0 +1,235 @@
+"""
+Jinja2 extensions providing compose, define and composition tags, compiled by
+Jinja2 like its own call blocks:
+
+    from compose_tags.jinja2 import ComposeExtension, composition_extension
+    from mydesignsystem.templatetags.mydesignsystem import button, card
+
+    def environment(**options):
+        return Environment(
+            extensions=[ComposeExtension, composition_extension(button, card)],
+            **options,
+        )
+
+    {% compose "card.html" title="Title" %}Card body{% endcompose %}
+    {% compose "card.html" takes_context %}Card body{% endcompose %}
+    {% define footer %}<a href="{{ url }}">More</a>{% enddefine %}
+    {% card footer=footer %}Card body{% endcard %}
+
+Children are the body of the tags, rendered on first use through caller().
+Composed templates are rendered isolated, with the CSRF token of the context,
+unless `compose` takes the context. The templates composed by composition tags
+are loaded from the Jinja2 environment.
+"""
+from inspect import signature
+
+from django.template import TemplateSyntaxError
+from django.template.loader_tags import construct_relative_path
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from compose_tags.batch import get_composition_node
+from compose_tags.children import LazyChildren
+from compose_tags.keys import make_memo_key
+
+# Variables of the Django Jinja2 backend's context forwarded to isolated templates.
+CSRF_VARIABLES = ("csrf_input", "csrf_token")
+
+
+class CallerChildren(LazyChildren):
+    """Children of a Jinja2 composition: the call block's caller, called on first use."""
+
+    def __init__(self, caller):
+        super().__init__(None, None)
+        self.caller = caller
+
+    def __repr__(self):
+        return "<%s: %r>" % (self.__class__.__name__, self.caller)
+
+    def render(self):
+        if self._rendered is None:
+            self._rendered = Markup(self.caller())
+        return self._rendered
+
+    def iter_chunks(self):
+        yield self.render()
+
+
+def copy_csrf_variables(context, values):
+    for name in CSRF_VARIABLES:
+        if name in context:
+            values[name] = context[name]
+
+
+def parse_arguments(parser, end_flags=()):
+    """
+    Parse the arguments of a tag until the end of the block, commas being
+    optional: positional expressions, name=expression keyword arguments and
+    names of end_flags. Returns args, kwargs and the flags found.
+    """
+    args = []
+    kwargs = []
+    flags = set()
+    while parser.stream.current.type != "block_end":
+        if args or kwargs or flags:
+            parser.stream.skip_if("comma")
+        token = parser.stream.current
+        if token.type == "name" and parser.stream.look().type == "assign":
+            next(parser.stream)
+            next(parser.stream)
+            kwargs.append(
+                nodes.Keyword(
+                    token.value, parser.parse_expression(), lineno=token.lineno
+                )
+            )
+        elif token.type == "name" and token.value in end_flags:
+            next(parser.stream)
+            flags.add(token.value)
+        else:
+            args.append(parser.parse_expression())
+    return args, kwargs, flags
+
+
+def make_dict(kwargs):
+    return nodes.Dict(
+        [
+            nodes.Pair(nodes.Const(keyword.key), keyword.value, lineno=keyword.lineno)
+            for keyword in kwargs
+        ]
+    )
+
+
+class ComposeExtension(Extension):
+    tags = {"compose", "define"}
+
+    def parse(self, parser):
+        token = next(parser.stream)
+        if token.value == "define":
+            return self.parse_define(parser, token.lineno)
+        return self.parse_compose(parser, token.lineno)
+
+    def parse_compose(self, parser, lineno):
+        template = parser.parse_expression()
+        if (
+            parser.name is not None
+            and isinstance(template, nodes.Const)
+            and isinstance(template.value, str)
+        ):
+            try:
+                relative_name = construct_relative_path(
+                    parser.name, '"%s"' % template.value
+                )
+            except TemplateSyntaxError as e:
+                parser.fail(str(e), lineno)
+            template = nodes.Const(relative_name[1:-1], lineno=template.lineno)
+        args, kwargs, flags = parse_arguments(parser, end_flags=("takes_context",))
+        if args:
+            parser.fail("'compose' only takes keyword arguments.", lineno)
+        if any(keyword.key == "children" for keyword in kwargs):
+            parser.fail(
+                "'compose' must not take children as a keyword argument.", lineno
+            )
+        body = parser.parse_statements(("name:endcompose",), drop_needle=True)
+        call = self.call_method(
+            "_compose",
+            [
+                template,
+                nodes.Const("takes_context" in flags),
+                nodes.ContextReference(),
+                make_dict(kwargs),
+            ],
+            lineno=lineno,
+        )
+        return nodes.CallBlock(call, [], [], body, lineno=lineno)
+
+    def parse_define(self, parser, lineno):
+        target = parser.parse_assign_target(name_only=True)
+        if parser.stream.current.type != "block_end":
+            parser.fail(
+                "define tag takes exactly one argument: the name of the template "
+                "variable that should store the result.",
+                lineno,
+            )
+        body = parser.parse_statements(("name:enddefine",), drop_needle=True)
+        return nodes.AssignBlock(target, None, body, lineno=lineno)
+
+    def _compose(self, template, takes_context, context, values, caller):
+        template = self.environment.get_or_select_template(
+            template, parent=context.name
+        )
+        values["children"] = CallerChildren(caller)
+        if takes_context:
+            return template.render({**context.get_all(), **values})
+        copy_csrf_variables(context, values)
+        return template.render(values)
+
+
+class CompositionExtension(Extension):
+    """Composition tags, see composition_extension."""
+
+    compositions = {}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        self.composition_nodes = {
+            name: get_composition_node(tag) for name, tag in self.compositions.items()
+        }
+
+    def parse(self, parser):
+        token = next(parser.stream)
+        name = token.value
+        args, kwargs, _ = parse_arguments(parser)
+        self.check_arguments(parser, token, args, kwargs)
+        body = parser.parse_statements((f"name:end{name}",), drop_needle=True)
+        call = self.call_method(
+            "_composition",
+            [
+                nodes.Const(name),
+                nodes.ContextReference(),
+                nodes.List(args),
+                make_dict(kwargs),
+            ],
+            lineno=token.lineno,
+        )
+        return nodes.CallBlock(call, [], [], body, lineno=token.lineno)
+
+    def check_arguments(self, parser, token, args, kwargs):
+        """Check the arguments at compile time, like the Django composition tags."""
+        node = self.composition_nodes[token.value]
+        leading = 2 if node.takes_context else 1
+        try:
+            signature(node.func).bind(
+                *[None] * (leading + len(args)),
+                **{keyword.key: None for keyword in kwargs},
+            )
+        except TypeError as e:
+            parser.fail("%r %s" % (token.value, e), token.lineno)
+
+    def _composition(self, name, context, args, kwargs, caller):
+        node = self.composition_nodes[name]
+        children = CallerChildren(caller)
+        resolved_args = [children, context] if node.takes_context else [children]
+        resolved_args.extend(args)
+        if node.memo is not None:
+            key = make_memo_key(resolved_args, kwargs)
+            values = node.call_memoized(resolved_args, kwargs, key)
+        else:
+            values = node.call(resolved_args, kwargs)
+        template = self.environment.get_or_select_template(node.filename)
+        copy_csrf_variables(context, values)
+        return template.render(values)
+
+
+def composition_extension(*tags, **named_tags):
+    """
+    Return a Jinja2 extension of composition tags: composition_tag decorated
+    functions, named after the function, or after their keyword.
+    """
+    compositions = {tag.__name__: tag for tag in tags}
+    compositions.update(named_tags)
+    return type(
+        "CompositionExtension",
+        (CompositionExtension,),
+        {"tags": set(compositions), "compositions": compositions},
+    )
@@ -0,0 +1,150 @@
+"""
+Keys of the caches of compose_tags: the fragment cache of `{% compose ... cache %}`,
+the memos of the composition functions and of their outputs, and the fingerprint.
+"""
+import datetime
+from decimal import Decimal
+from uuid import UUID
+
+from django.middleware.csrf import CSRF_TOKEN_LENGTH
+from django.utils.timezone import get_current_timezone_name
+from django.utils.translation import get_language
+
+from compose_tags.analysis import reads_csrf_token
+from compose_tags.cache import md5
+from compose_tags.children import is_lazy_children, render_lazy_arguments
+
+try:
+    from django.middleware.csrf import _unmask_cipher_token
+except ImportError:  # Django < 4.1
+    from django.middleware.csrf import _unsalt_cipher_token as _unmask_cipher_token
+
+# Immutable types whose repr fully represents the value.
+PRIMITIVE_TYPES = (
+    str,
+    bytes,
+    int,
+    float,
+    Decimal,
+    type(None),
+    datetime.date,
+    datetime.time,
+    datetime.timedelta,
+    UUID,
+)
+
+
+def is_primitive(value):
+    """Whether value is of PRIMITIVE_TYPES, or a tuple of them."""
+    if isinstance(value, tuple):
+        return all(is_primitive(item) for item in value)
+    return isinstance(value, PRIMITIVE_TYPES)
+
+
+def get_stable_repr(value):
+    """
+    A string fully representing value, for cache keys: the type and repr of
+    PRIMITIVE_TYPES, also within lists, tuples and dicts, and of the result of
+    the value's compose_key() method, e.g. `return (self.pk, self.modified)`.
+    Children and slots are rendered.
+
+    None for any other value: its string, and even its hash, may stay the same
+    when its content changes, e.g. a model instance.
+    """
+    if is_lazy_children(value):
+        value = value.render()
+    if isinstance(value, PRIMITIVE_TYPES):
+        return "%s:%r" % (type(value).__qualname__, value)
+    if isinstance(value, dict):
+        items = [(get_stable_repr(k), get_stable_repr(v)) for k, v in value.items()]
+        if any(k is None or v is None for k, v in items):
+            return None
+        return "dict:{%s}" % ",".join("%s=%s" % item for item in sorted(items))
+    if isinstance(value, (list, tuple)):
+        parts = [get_stable_repr(item) for item in value]
+        if None in parts:
+            return None
+        return "%s:[%s]" % (type(value).__qualname__, ",".join(parts))
+    compose_key = getattr(value, "compose_key", None)
+    if callable(compose_key):
+        key = get_stable_repr(compose_key())
+        if key is not None:
+            return "%s.compose_key:%s" % (type(value).__qualname__, key)
+    return None
+
+
+def get_csrf_secret(csrf_token):
+    """
+    The secret of a CSRF token: the token is masked differently on each request,
+    the secret stays the same for a user.
+    """
+    token = str(csrf_token)
+    if len(token) == CSRF_TOKEN_LENGTH:
+        return _unmask_cipher_token(token)
+    return token
+
+
+def make_fragment_key(template_name, values, environment):
+    """
+    Same idea as django.core.cache.utils.make_template_fragment_key, keyed on
+    the composed template, every value it receives (children included) and the
+    output environment, see get_output_environment.
+    Returns None if a value has no stable representation, see get_stable_repr.
+
+    The CSRF token is left out: the environment holds the secret of the token,
+    for templates reading it.
+    """
+    hasher = md5()
+    hasher.update(str(template_name).encode())
+    for name in sorted(values):
+        if name == "csrf_token":
+            continue
+        value = get_stable_repr(values[name])
+        if value is None:
+            return None
+        hasher.update(b"\0")
+        hasher.update(name.encode())
+        hasher.update(b"=")
+        hasher.update(value.encode())
+    hasher.update(b"\1")
+    hasher.update(repr(environment).encode())
+    return "compose_tags.fragment.%s" % hasher.hexdigest()
+
+
+def make_memo_key(resolved_args, resolved_kwargs):
+    """
+    Return a hashable key of the arguments, like functools.lru_cache(typed=True),
+    or None if an argument isn't an immutable primitive, see is_primitive: e.g.
+    model instances hash by primary key, their memoized values would never be
+    updated. Children and slots are rendered in place: memoized values must not
+    hold the context they were rendered with.
+    """
+    render_lazy_arguments(resolved_args, resolved_kwargs)
+    kwargs = sorted(resolved_kwargs.items())
+    if not all(is_primitive(value) for value in resolved_args) or not all(
+        is_primitive(value) for _, value in kwargs
+    ):
+        return None
+    return (
+        tuple(resolved_args),
+        tuple(kwargs),
+        tuple(type(value) for value in resolved_args),
+        tuple(type(value) for _, value in kwargs),
+    )
+
+
+def get_output_environment(context, template):
+    """
+    What the output of a composition depends on, besides its values. The CSRF
+    token is masked differently on each request: outputs only depend on its
+    secret, for templates reading it.
+    """
+    csrf_token = context.get("csrf_token") if reads_csrf_token(template) else None
+    return (
+        None if csrf_token is None else get_csrf_secret(csrf_token),
+        context.autoescape,
+        context.use_l10n,
+        context.use_tz,
+        get_language(),
+        get_current_timezone_name(),
+    )
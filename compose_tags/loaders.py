@@ -0,0 +1,233 @@
+"""
+Template loader persisting compiled templates on disk across processes:
+
+TEMPLATES = [{
+    "BACKEND": "django.template.backends.django.DjangoTemplates",
+    "OPTIONS": {
+        "loaders": [
+            ("compose_tags.loaders.PersistentLoader", [
+                "django.template.loaders.filesystem.Loader",
+                "django.template.loaders.app_directories.Loader",
+            ]),
+        ],
+    },
+}]
+
+Compiled templates are pickled in COMPOSE_TAGS["COMPILED_TEMPLATES_DIR"], which must
+be set, one file per template, keyed by the template's name and source and by the
+versions of Python, Django, compose_tags and the engine's template libraries, and by
+the modification times and sizes of the compose_tags and template libraries' sources.
+The directory is created readable by the current user only, and files are signed
+with the SECRET_KEY: files whose signature doesn't match are never unpickled.
+Templates that can't be pickled, and files that can't be loaded, are compiled as usual.
+"""
+import importlib
+import io
+import logging
+import os
+import pickle
+import sys
+import tempfile
+from hashlib import sha1, sha256
+
+import django
+from django.core.exceptions import ImproperlyConfigured
+from django.template import Template, TemplateDoesNotExist, smartif
+from django.template.loaders.base import Loader as BaseLoader
+from django.template.loaders.cached import Loader as CachedLoader
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+import compose_tags
+from compose_tags.conf import compose_settings
+
+logger = logging.getLogger("compose_tags.loaders")
+
+KEY_SALT = "compose_tags.loaders.PersistentLoader"
+# Size of the signatures of salted_hmac's default algorithm, prefixing the pickles.
+SIGNATURE_SIZE = sha1().digest_size
+
+
+def sign(payload):
+    return salted_hmac(KEY_SALT, payload).digest()
+
+
+def get_file_version(path):
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+class TemplatePickler(pickle.Pickler):
+    """Pickle templates, objects shared with the engine being pickled by reference."""
+
+    def __init__(self, file, shared):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.shared = shared
+
+    def persistent_id(self, obj):
+        return self.shared.get(id(obj))
+
+
+class TemplateUnpickler(pickle.Unpickler):
+    def __init__(self, file, shared):
+        super().__init__(file)
+        self.shared = shared
+
+    def persistent_load(self, pid):
+        return self.shared[pid]
+
+
+class CompilingLoader(BaseLoader):
+    """
+    Base Loader.get_template compiling templates through get_compiled_template.
+    Placed after the cached loader in PersistentLoader's MRO, so its get_template
+    is the one the cached loader calls on cache misses.
+    """
+
+    def get_template(self, template_name, skip=None):
+        tried = []
+
+        for origin in self.get_template_sources(template_name):
+            if skip is not None and origin in skip:
+                tried.append((origin, "Skipped to avoid recursion"))
+                continue
+
+            try:
+                contents = self.get_contents(origin)
+            except TemplateDoesNotExist:
+                tried.append((origin, "Source does not exist"))
+                continue
+            else:
+                return self.get_compiled_template(contents, origin)
+
+        raise TemplateDoesNotExist(template_name, tried=tried)
+
+    def get_compiled_template(self, contents, origin):
+        return Template(contents, origin, origin.template_name, self.engine)
+
+
+class PersistentLoader(CachedLoader, CompilingLoader):
+    def __init__(self, engine, loaders):
+        super().__init__(engine, loaders)
+        self._shared = None
+        self._versions = None
+
+    @property
+    def directory(self):
+        directory = compose_settings.COMPILED_TEMPLATES_DIR
+        if not directory:
+            raise ImproperlyConfigured(
+                'PersistentLoader requires COMPOSE_TAGS["COMPILED_TEMPLATES_DIR"].'
+            )
+        return directory
+
+    def get_library_modules(self):
+        modules = list(self.engine.builtins) + list(self.engine.libraries.values())
+        return [importlib.import_module(module) for module in modules]
+
+    @property
+    def versions(self):
+        """Key of the versions of everything compiled templates depend on."""
+        if self._versions is None:
+            versions = [
+                sys.version,
+                django.__version__,
+                compose_tags.__version__,
+                # Children are minified at compile time.
+                f"MINIFY={compose_settings.MINIFY}",
+            ]
+            # The nodes' classes pickled in the templates change without __version__ in
+            # development and editable installs.
+            package = os.path.dirname(compose_tags.__file__)
+            for name in sorted(os.listdir(package)):
+                if name.endswith(".py"):
+                    path = os.path.join(package, name)
+                    versions.append(f"{name}:{get_file_version(path)}")
+            for module in self.get_library_modules():
+                versions.append(module.__name__)
+                path = getattr(module, "__file__", None)
+                if path:
+                    versions.append(get_file_version(path))
+            self._versions = "\n".join(versions)
+        return self._versions
+
+    @property
+    def shared(self):
+        """
+        {persistent id: object} of the objects referenced by compiled templates
+        but owned by the engine: the engine, loaders, tags and filters functions.
+        """
+        if self._shared is None:
+            shared = {("engine",): self.engine}
+            for index, loader in enumerate(self.loaders):
+                shared[("loader", index)] = loader
+            for name, operator in smartif.OPERATORS.items():
+                shared[("operator", name)] = operator
+            libraries = [
+                (("builtin", index), library)
+                for index, library in enumerate(self.engine.template_builtins)
+            ] + [
+                (("library", name), library)
+                for name, library in self.engine.template_libraries.items()
+            ]
+            for key, library in libraries:
+                for kind in ("tags", "filters"):
+                    for name, func in getattr(library, kind).items():
+                        shared[(*key, kind, name)] = func
+                        for attr in ("__wrapped__", "memo", "output_memo"):
+                            if getattr(func, attr, None) is not None:
+                                shared[(*key, kind, name, attr)] = getattr(func, attr)
+            self._shared = shared
+        return self._shared
+
+    def get_path(self, contents, origin):
+        key = "\n".join(
+            (self.versions, str(origin.name), str(origin.template_name), contents)
+        )
+        return os.path.join(
+            self.directory, sha256(key.encode()).hexdigest() + ".pickle"
+        )
+
+    def get_compiled_template(self, contents, origin):
+        path = self.get_path(contents, origin)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            signature, payload = data[:SIGNATURE_SIZE], data[SIGNATURE_SIZE:]
+            if constant_time_compare(signature, sign(payload)):
+                return TemplateUnpickler(io.BytesIO(payload), self.shared).load()
+            logger.warning("Invalid signature of compiled template %s", path)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logger.warning(
+                "Can't load compiled template %s", origin.name, exc_info=True
+            )
+        template = super().get_compiled_template(contents, origin)
+        self.save(template, path)
+        return template
+
+    def save(self, template, path):
+        shared_ids = {id(obj): key for key, obj in self.shared.items()}
+        buffer = io.BytesIO()
+        try:
+            TemplatePickler(buffer, shared_ids).dump(template)
+        except Exception:
+            logger.debug(
+                "Can't pickle template %s", template.origin.name, exc_info=True
+            )
+            return
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            # Write then rename, so that concurrent processes never read a partial file.
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+            payload = buffer.getvalue()
+            with os.fdopen(fd, "wb") as f:
+                f.write(sign(payload) + payload)
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.warning("Can't save compiled template %s", path, exc_info=True)
+
+    def reset(self):
+        super().reset()
+        self._shared = None
+        self._versions = None
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+
+from compose_tags.graph import get_composition_tags, precompile
+
+
+class Command(BaseCommand):
+    help = (
+        "Compile all templates, warming the cached loaders, and report the "
+        "dependency graph of composed templates."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chains",
+            type=int,
+            default=5,
+            help="Number of deepest composition chains to report.",
+        )
+
+    def handle(self, *args, chains, **options):
+        for graph in precompile():
+            self.report(graph, chains)
+
+    def report(self, graph, chains):
+        self.stdout.write(
+            f"Compiled {len(graph.templates)} templates, "
+            f"{len(graph.components)} composed."
+        )
+        for template_name, error in sorted(graph.errors.items()):
+            self.stderr.write(f"Can't compile {template_name}: {error}")
+        if graph.dynamic:
+            self.stdout.write(
+                "Dynamic compose targets: "
+                + ", ".join(
+                    f"{name} ({count})" for name, count in sorted(graph.dynamic.items())
+                )
+            )
+
+        used = graph.components
+        unused = sorted(
+            f"{tag} ({template_name})"
+            for tag, template_name in get_composition_tags(graph.engine).items()
+            if template_name not in used
+        )
+        if unused:
+            self.stdout.write("Unused composition tags: " + ", ".join(unused))
+
+        for cycle in graph.find_cycles():
+            self.stdout.write(
+                self.style.WARNING("Cycle: " + " -> ".join(cycle)),
+            )
+        for chain in graph.longest_chains(chains):
+            if len(chain) > 1:
+                self.stdout.write(f"Depth {len(chain) - 1}: " + " -> ".join(chain))
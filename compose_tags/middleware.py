@@ -0,0 +1,126 @@
+import logging
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.utils.timezone import get_current_timezone_name
+from django.utils.translation import get_language
+
+from compose_tags.cache import md5
+from compose_tags.conf import compose_settings
+from compose_tags.fingerprint import fingerprint
+from compose_tags.graph import get_django_engines, iter_template_sources
+from compose_tags.profiling import profile
+
+logger = logging.getLogger("compose_tags.profiling")
+
+
+class ComposeProfileMiddleware:
+    """
+    Profile compose and composition tags rendered during each request.
+
+    The profile is available as request.compose_profile, logged at DEBUG level on
+    the "compose_tags.profiling" logger, and the most expensive components are
+    reported in the Server-Timing header. Responses streamed after the middleware
+    returns are not profiled.
+    """
+
+    server_timing_components = 5
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with profile() as compose_profile:
+            request.compose_profile = compose_profile
+            response = self.get_response(request)
+        summary = compose_profile.summary()
+        if summary:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Compose profile of %s:\n%s",
+                    request.path,
+                    "\n".join(
+                        "%s: %d calls, %d bytes, template %.2fms, arguments %.2fms, "
+                        "render %.2fms, children %.2fms"
+                        % (
+                            name,
+                            stats.calls,
+                            stats.size,
+                            stats.template * 1000,
+                            stats.arguments * 1000,
+                            stats.render * 1000,
+                            stats.children * 1000,
+                        )
+                        for name, stats in summary
+                    ),
+                )
+            server_timing = [
+                'compose;desc="%s";dur=%.2f'
+                % (name, (stats.template + stats.arguments + stats.render) * 1000)
+                for name, stats in summary[: self.server_timing_components]
+            ]
+            if response.has_header("Server-Timing"):
+                server_timing.insert(0, response["Server-Timing"])
+            response["Server-Timing"] = ", ".join(server_timing)
+        return response
+
+
+class ComposeETagMiddleware:
+    """
+    Set a strong ETag derived from the inputs of the compose and composition tags
+    rendered during the request, the request's path, the active language and time
+    zone, and the ETAG_SALT setting, and return 304 Not Modified responses when it
+    matches If-None-Match.
+
+    The ETag doesn't cover the values rendered outside of compose and composition
+    tags: only use it for views whose other output only depends on the templates'
+    sources, covered by the default salt, or on what they add with
+    request.compose_fingerprint.update(value), e.g. with
+    django.utils.decorators.decorator_from_middleware. Responses whose fingerprint
+    is unstable, see compose_tags.fingerprint, don't get an ETag.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._templates_digest = None
+
+    @property
+    def salt(self):
+        salt = compose_settings.ETAG_SALT
+        if salt is not None:
+            return salt
+        if self._templates_digest is None:
+            # The page templates, and those they extend and include, change with
+            # deploys: computed once per process.
+            hasher = md5()
+            for engine in get_django_engines():
+                for name, source in iter_template_sources(engine):
+                    hasher.update(("%s\0%s\0" % (name, source)).encode())
+            self._templates_digest = hasher.hexdigest()
+        return self._templates_digest
+
+    def __call__(self, request):
+        with fingerprint() as page_fingerprint:
+            request.compose_fingerprint = page_fingerprint
+            response = self.get_response(request)
+        if (
+            request.method not in ("GET", "HEAD")
+            or response.status_code != 200
+            or response.streaming
+            or response.has_header("ETag")
+            or not page_fingerprint.components
+            or not page_fingerprint.stable
+        ):
+            return response
+        page_fingerprint.update(
+            (
+                request.get_full_path(),
+                get_language(),
+                get_current_timezone_name(),
+                self.salt,
+            )
+        )
+        response["ETag"] = quote_etag(page_fingerprint.hexdigest())
+        return get_conditional_response(
+            request, etag=response["ETag"], response=response
+        )
@@ -0,0 +1,130 @@
+"""
+Compile-time whitespace minification of compose and composition nodelists and of
+composed templates, enabled by COMPOSE_TAGS["MINIFY"].
+
+Whitespace runs spanning lines, the indentation of the templates' source, are:
+- removed between block-level tags, which don't display it: `<ul>\n    <li>` becomes
+  `<ul><li>`,
+- collapsed to a single space otherwise, next to inline tags as well:
+  `Hello\n    <b>{{ name }}</b>` becomes `Hello <b>{{ name }}</b>`.
+The content of <pre>, <textarea>, <script> and <style> elements is kept as is.
+"""
+import re
+
+from django.template.base import Template, TextNode
+from django.template.defaulttags import IfNode
+
+LINES_WHITESPACE_RE = re.compile(r"\s*\n\s*")
+RAW_ELEMENT_RE = re.compile(r"<(/?)(pre|textarea|script|style)\b[^>]*>", re.IGNORECASE)
+TAG_START_RE = re.compile(r"</?([a-zA-Z][a-zA-Z0-9]*)")
+TAG_END_RE = re.compile(r"</?([a-zA-Z][a-zA-Z0-9]*)[^<>]*>")
+# Block-level elements, the whitespace between two of their tags isn't displayed.
+BLOCK_ELEMENTS = frozenset(
+    (
+        "address article aside base blockquote body caption col colgroup dd details "
+        "dialog div dl dt fieldset figcaption figure footer form h1 h2 h3 h4 h5 h6 "
+        "head header hgroup hr html li link main meta nav ol p pre section summary "
+        "table tbody td tfoot th thead title tr ul"
+    ).split()
+)
+
+
+def is_block_tag(match):
+    return match is not None and match.group(1).lower() in BLOCK_ELEMENTS
+
+
+def between_block_tags(text, start, end):
+    """Whether text[start:end] is preceded and followed by block-level tags."""
+    if not is_block_tag(TAG_START_RE.match(text, end)):
+        return False
+    tag_start = text.rfind("<", 0, start)
+    return tag_start != -1 and is_block_tag(
+        TAG_END_RE.fullmatch(text, tag_start, start)
+    )
+
+
+def collapse_whitespace(text, start=0, end=None):
+    """Collapse the whitespace of text[start:end], the tags around it included."""
+    end = len(text) if end is None else end
+    chunks = []
+    for match in LINES_WHITESPACE_RE.finditer(text, start, end):
+        chunks.append(text[start : match.start()])
+        blank = between_block_tags(text, match.start(), match.end())
+        chunks.append("" if blank else " ")
+        start = match.end()
+    chunks.append(text[start:end])
+    return "".join(chunks)
+
+
+def minify_text(text, raw_element=None):
+    """
+    Return text minified and the raw element still open at its end, if any,
+    raw_element being the one open at its start.
+    """
+    chunks = []
+    position = 0
+    for match in RAW_ELEMENT_RE.finditer(text):
+        closing, element = match.group(1), match.group(2).lower()
+        if raw_element is None and not closing:
+            chunks.append(collapse_whitespace(text, position, match.start()))
+            chunks.append(match.group())
+            position = match.end()
+            raw_element = element
+        elif raw_element == element and closing:
+            chunks.append(text[position : match.end()])
+            position = match.end()
+            raw_element = None
+    if raw_element is None:
+        chunks.append(collapse_whitespace(text, position))
+    else:
+        chunks.append(text[position:])
+    return "".join(chunks), raw_element
+
+
+def iter_child_nodelists(node):
+    if isinstance(node, IfNode):
+        # IfNode.nodelist is a copy of its branches' nodes.
+        for _, nodelist in node.conditions_nodelists:
+            yield nodelist
+        return
+    for attr in node.child_nodelists:
+        nodelist = getattr(node, attr, None)
+        if nodelist is not None:
+            yield nodelist
+    # Slots of compose and composition nodes.
+    yield from getattr(node, "slots", {}).values()
+
+
+def minify_nodelist(nodelist, raw_element=None):
+    """
+    Minify the TextNodes of nodelist and of its nested nodelists in place, in
+    source order. Returns the raw element still open at the end of nodelist.
+    """
+    nodes = []
+    for node in nodelist:
+        if isinstance(node, TextNode):
+            node.s, raw_element = minify_text(node.s, raw_element)
+            if not node.s:
+                continue
+        else:
+            for child_nodelist in iter_child_nodelists(node):
+                raw_element = minify_nodelist(child_nodelist, raw_element)
+        nodes.append(node)
+    nodelist[:] = nodes
+    return raw_element
+
+
+def minify_template(template):
+    """
+    Return a minified copy of a composed template, compiled once and held by the
+    template: the template itself is shared with include and render_to_string,
+    which render it as is.
+    """
+    minified = getattr(template, "compose_minified", None)
+    if minified is None:
+        minified = Template(
+            template.source, template.origin, template.name, template.engine
+        )
+        minify_nodelist(minified.nodelist)
+        template.compose_minified = minified
+    return minified
@@ -1,34 +1,352 @@
-from django.template import Node
+import asyncio
+from copy import copy
+
+from django.template import Context, Node, NodeList, Template, defaultfilters
+from django.template.base import TextNode, Variable
+from django.template.defaulttags import IfChangedNode
+from django.template.exceptions import TemplateSyntaxError
 from django.template.library import InclusionNode
-from django.template.loader_tags import construct_relative_path
+from django.template.loader_tags import IncludeNode, construct_relative_path
+from django.utils.safestring import SafeString
+
+from compose_tags.analysis import check_arguments, get_lazy_names
+from compose_tags.asynchronous import freeze_context, gather_template, is_gathering
+from compose_tags.cache import fragment_cache_stats, get_fragment_cache
+from compose_tags.children import get_children, is_lazy_children, render_lazy_arguments
+from compose_tags.conf import compose_settings
+from compose_tags.fingerprint import add_fingerprint
+from compose_tags.keys import get_output_environment, make_fragment_key, make_memo_key
+from compose_tags.minify import minify_template
+from compose_tags.parallel import in_atomic_block, in_worker, submit
+from compose_tags.profiling import Timings, get_active_profile
+from compose_tags.streaming import iter_template
 
 COMPOSE_CONTEXT_KEY = "_django_compose_context_key"
+# Nodes reading forloop without mentioning it: ifchanged keeps its state in it.
+FORLOOP_NODES = (IfChangedNode, IncludeNode)
+
+
+def render_composed(template, context):
+    """Render a composed template from within the caller's render."""
+    if is_gathering() and context.template is not None:
+        return gather_template(template, context)
+    return template.render(context)
+
+
+def select_composed_template(engine, template_name):
+    template = engine.select_template(template_name)
+    if compose_settings.MINIFY:
+        return minify_template(template)
+    return template
+
+
+def set_children_timings(values, timings):
+    for value in values:
+        if is_lazy_children(value):
+            value.timings = timings
+
+
+def render_eager_children(template, values, streaming=False):
+    """
+    Render in place the children and slots of values that template doesn't only
+    output as `{{ name }}`: filters, conditions and nested tags get a SafeString.
+    Those it outputs on each render are rendered upfront too, unless streaming.
+    """
+    lazy_names = get_lazy_names(template, streaming)
+    for name, value in values.items():
+        if is_lazy_children(value) and name not in lazy_names:
+            values[name] = value.render()
+
+
+# Builtin filters whose output only depends on their input and argument: unlike
+# e.g. date or truncatechars, they don't depend on the active language or time.
+CONSTANT_FILTERS = {
+    defaultfilters.add,
+    defaultfilters.addslashes,
+    defaultfilters.capfirst,
+    defaultfilters.center,
+    defaultfilters.cut,
+    defaultfilters.default,
+    defaultfilters.default_if_none,
+    defaultfilters.divisibleby,
+    defaultfilters.escape,
+    defaultfilters.first,
+    defaultfilters.last,
+    defaultfilters.length,
+    defaultfilters.ljust,
+    defaultfilters.lower,
+    defaultfilters.rjust,
+    defaultfilters.safe,
+    defaultfilters.slugify,
+    defaultfilters.stringformat,
+    defaultfilters.striptags,
+    defaultfilters.title,
+    defaultfilters.upper,
+    defaultfilters.urlencode,
+    defaultfilters.wordcount,
+    defaultfilters.wordwrap,
+}
+CONSTANT_TYPES = (str, int, float, bool, type(None))
+# True, False and None are looked up in the context's builtins.
+BUILTIN_LOOKUPS = (("True",), ("False",), ("None",))
+NOT_CONSTANT = object()
+
+
+def resolve_constant(filter_expression):
+    """
+    Resolve a FilterExpression at compile time: a literal, optionally followed by
+    CONSTANT_FILTERS with literal arguments. Return NOT_CONSTANT otherwise.
+    """
+    var = filter_expression.var
+    if isinstance(var, Variable) and (
+        var.translate or var.lookups not in (None, *BUILTIN_LOOKUPS)
+    ):
+        return NOT_CONSTANT
+    for func, args in filter_expression.filters:
+        if func not in CONSTANT_FILTERS or any(lookup for lookup, _ in args):
+            return NOT_CONSTANT
+    try:
+        value = filter_expression.resolve(Context())
+    except Exception:
+        # Raised again on each render, as without folding.
+        return NOT_CONSTANT
+    # Immutable values only: the value is shared by all renders.
+    if not isinstance(value, CONSTANT_TYPES):
+        return NOT_CONSTANT
+    return value
+
+
+def fold_constants(kwargs):
+    """Split kwargs into their compile-time values and the remaining expressions."""
+    constants = {}
+    variables = {}
+    for name, filter_expression in kwargs.items():
+        value = resolve_constant(filter_expression)
+        if value is NOT_CONSTANT:
+            variables[name] = filter_expression
+        else:
+            constants[name] = value
+    return constants, variables
+
+
+def nodelist_is_constant(nodelist):
+    return all(isinstance(node, TextNode) for node in nodelist)
+
+
+def make_constant_key(constant_args, constant_kwargs, nodelist, slots):
+    """Memo key of a composition of literal arguments and plain text children."""
+    sources = {
+        "slot:%s" % name: "".join(node.s for node in slot)
+        for name, slot in (slots or {}).items()
+    }
+    return make_memo_key(
+        ["".join(node.s for node in nodelist), *constant_args],
+        {**constant_kwargs, **sources},
+    )
+
+
+def get_passed_names(names, nodelist, slots):
+    """Names of the values a composition passes, children only when not blank."""
+    passed = [*names, *slots]
+    if any(not isinstance(node, TextNode) or node.s.strip() for node in nodelist):
+        passed.append("children")
+    return passed
+
+
+def default_composition(children, **kwargs):
+    kwargs["children"] = children
+    return kwargs
+
+
+class SlotsMixin:
+    """Named slots: nodelists rendered lazily, like children, into their own variable."""
+
+    def get_nodes_by_type(self, nodetype):
+        nodes = super().get_nodes_by_type(nodetype)
+        for nodelist in self.slots.values():
+            nodes.extend(nodelist.get_nodes_by_type(nodetype))
+        return nodes
+
+    def get_slots(self, context):
+        return {
+            name: get_children(nodelist, context)
+            for name, nodelist in self.slots.items()
+        }
 
 
-class ComposeNode(Node):
+def render_isolated(node, template, context, values):
+    """
+    Render template with context.new(values), reusing the isolated context of the
+    node's previous render within the current template render: compositions in a
+    loop don't allocate a new context on each iteration.
+    """
+    pool = context.render_context.get(COMPOSE_CONTEXT_KEY)
+    if pool is None:
+        pool = context.render_context[COMPOSE_CONTEXT_KEY] = {}
+    # Taken out of the pool while in use: recursive compositions get their own.
+    isolated_context = pool.pop(node, None)
+    if isolated_context is None:
+        isolated_context = context.new(values)
+    else:
+        # Same state as context.new(values) would give.
+        isolated_context.dicts = [isolated_context.dicts[0], values]
+        isolated_context.autoescape = context.autoescape
+        isolated_context.use_l10n = context.use_l10n
+        isolated_context.use_tz = context.use_tz
+    try:
+        return render_composed(template, isolated_context)
+    finally:
+        # Pooled without values: they'd keep the rendered children alive.
+        del isolated_context.dicts[1:]
+        pool[node] = isolated_context
+
+
+def copy_csrf_token(context, values):
+    # Copy across the CSRF token, if present, because we need instructions for using CSRF
+    # protection to be as simple as possible.
+    csrf_token = context.get("csrf_token")
+    if csrf_token is not None:
+        values["csrf_token"] = csrf_token
+
+
+class ComposeNode(SlotsMixin, Node):
     def __init__(
         self,
         template,
         nodelist,
         extra_context,
         takes_context,
+        cache_timeout=None,
+        slots=None,
     ):
         super().__init__()
         self.nodelist = nodelist
+        self.slots = slots or {}
         self.template = template
         self.extra_context = extra_context or {}
+        # Literal values are resolved once, at compile time.
+        self.constant_context, self.variable_context = fold_constants(
+            self.extra_context
+        )
         self.takes_context = takes_context
+        self.cache_timeout = cache_timeout
+        # A literal template name is known at compile time, the template is then
+        # selected on first render and held on the node.
+        if isinstance(template.var, str) and not template.filters:
+            self.constant_template_name = (template.var,)
+        else:
+            self.constant_template_name = None
+        self.constant_template = None
+        # The constant and variable context the composed template reads, pruned
+        # once the constant template is selected.
+        self.template_context = (self.constant_context, self.variable_context)
+
+    def __getstate__(self):
+        # Pickled by compose_tags.loaders: the selected template is loaded again.
+        return {
+            **self.__dict__,
+            "constant_template": None,
+            "template_context": (self.constant_context, self.variable_context),
+        }
 
     def render(self, context):
+        compose_profile = get_active_profile()
+        if compose_profile is not None:
+            return self.render_profiled(context, compose_profile)
         template = self.get_template(context)
-        render_context = self.get_render_context(context)
+        render_context = self.get_render_context(context, template)
+        self.add_fingerprint(template, render_context, context)
+        if self.cache_timeout is not None:
+            return self.render_cached(template, render_context, context)
+        return self.render_template(template, render_context, context)
+
+    def add_fingerprint(self, template, render_context, context):
+        add_fingerprint(template, render_context, context, self.takes_context)
+
+    def render_profiled(self, context, compose_profile):
+        timings = Timings()
+        with timings.measure("template"):
+            template = self.get_template(context)
+        with timings.measure("arguments"):
+            render_context = self.get_render_context(context, template, timings)
+        set_children_timings(render_context.values(), timings)
+        self.add_fingerprint(template, render_context, context)
+        with timings.measure("render"):
+            if self.cache_timeout is not None:
+                output = self.render_cached(template, render_context, context)
+            else:
+                output = self.render_template(template, render_context, context)
+        compose_profile.record(self.__class__, template, timings, len(output))
+        return output
+
+    def render_template(self, template, render_context, context):
         if self.takes_context:
             with context.push(**render_context):
-                return template.render(context)
-        return template.render(context.new(render_context))
+                return render_composed(template, context)
+        return render_isolated(self, template, context, render_context)
+
+    def render_iter(self, context):
+        """Streaming equivalent of render, see compose_tags.streaming."""
+        if self.cache_timeout is not None:
+            yield self.render(context)
+            return
+        template = self.get_template(context)
+        render_context = self.get_render_context(context, template, streaming=True)
+        self.add_fingerprint(template, render_context, context)
+        if self.takes_context:
+            with context.push(**render_context):
+                yield from iter_template(template, context)
+        else:
+            yield from iter_template(template, context.new(render_context))
+
+    def render_cached(self, template, render_context, context):
+        """
+        Cache the output keyed on the composed template and everything it receives.
+        Only isolated composition can be cached: render_context is then all the
+        composed template has access to.
+        """
+        timeout = self.get_cache_timeout(context)
+        fragment_cache = get_fragment_cache()
+        cache_key = make_fragment_key(
+            template.origin.name,
+            render_context,
+            get_output_environment(context, template),
+        )
+        if cache_key is None:
+            # A value without a stable representation can't key the output.
+            return self.render_template(template, render_context, context)
+        value = fragment_cache.get(cache_key)
+        if value is None:
+            fragment_cache_stats.miss()
+            value = self.render_template(template, render_context, context)
+            fragment_cache.set(cache_key, value, timeout)
+        else:
+            fragment_cache_stats.hit()
+        return value
+
+    def get_cache_timeout(self, context):
+        """Same rules as django's {% cache %} expire_time: None caches forever."""
+        timeout = self.cache_timeout.resolve(context)
+        if timeout is not None:
+            try:
+                timeout = int(timeout)
+            except (ValueError, TypeError):
+                raise TemplateSyntaxError(
+                    "compose got a non-integer cache timeout value: %r" % timeout
+                )
+        return timeout
 
     def get_template(self, context):
         """Very similar implementation to django.template.loader_tags.IncludeNode"""
+        if self.constant_template_name is not None:
+            template = self.constant_template
+            if template is None:
+                template = select_composed_template(
+                    context.template.engine, self.constant_template_name
+                )
+                self.template_context = self.get_template_context(template)
+                self.constant_template = template
+            return template
         template = self.template.resolve(context)
         # Does this quack like a Template?
         if not callable(getattr(template, "render", None)):
@@ -46,153 +364,500 @@ class ComposeNode(Node):
             cache = context.render_context.dicts[0].setdefault(self, {})
             template = cache.get(template_name)
             if template is None:
-                template = context.template.engine.select_template(template_name)
+                template = select_composed_template(
+                    context.template.engine, template_name
+                )
                 cache[template_name] = template
         # Use the base.Template of a backends.django.Template.
         elif hasattr(template, "template"):
             template = template.template
         return template
 
-    def get_render_context(self, context):
-        values = {
-            name: var.resolve(context) for name, var in self.extra_context.items()
-        }
-        values["children"] = self.nodelist.render(context)
-        # Copy across the CSRF token, if present, because we need instructions for using CSRF
-        # protection to be as simple as possible.
+    def get_template_context(self, template):
+        """
+        The constant and variable context template reads, see compose_tags.analysis.
+        With takes_context, the template may read any variable.
+        """
+        if self.takes_context:
+            return self.constant_context, self.variable_context
+        read = check_arguments(
+            self,
+            template,
+            get_passed_names(self.extra_context, self.nodelist, self.slots),
+        )
+        return (
+            {k: v for k, v in self.constant_context.items() if k in read},
+            {k: v for k, v in self.variable_context.items() if k in read},
+        )
+
+    def get_render_context(self, context, template, timings=None, streaming=False):
+        constant_context, variable_context = self.template_context
+        values = {name: var.resolve(context) for name, var in variable_context.items()}
+        values.update(constant_context)
+        # Children and slots are rendered upfront, unless the composed template
+        # may not output them: they are then only rendered if it does. With
+        # takes_context, it renders in a context layer pushed on top of ours:
+        # lazy children must not see it.
+        lazy_names = get_lazy_names(template, streaming)
+        values["children"] = get_children(
+            self.nodelist,
+            context,
+            "children" in lazy_names,
+            self.takes_context,
+            timings,
+        )
+        for name, nodelist in self.slots.items():
+            values[name] = get_children(
+                nodelist, context, name in lazy_names, self.takes_context, timings
+            )
         if not self.takes_context:
-            csrf_token = context.get("csrf_token")
-            if csrf_token is not None:
-                values["csrf_token"] = csrf_token
+            copy_csrf_token(context, values)
         return values
 
 
-class CompositionNode(InclusionNode):
-    def __init__(self, func, takes_context, args, kwargs, filename, nodelist):
+class CompositionNode(SlotsMixin, InclusionNode):
+    def __init__(
+        self,
+        func,
+        takes_context,
+        args,
+        kwargs,
+        filename,
+        nodelist,
+        slots=None,
+        memo=None,
+        output_memo=None,
+    ):
         super().__init__(func, takes_context, args, kwargs, filename)
         self.nodelist = nodelist
+        self.slots = slots or {}
+        self.composed_template = None
+        # LRUCaches shared by the nodes of a memoized composition function, of
+        # its values and of its outputs.
+        self.memo = memo
+        self.output_memo = output_memo
+        self.is_async = asyncio.iscoroutinefunction(func)
+        # Literal arguments are resolved once, at compile time.
+        self.constant_args = [resolve_constant(var) for var in args]
+        self.constant_kwargs, self.variable_kwargs = fold_constants(kwargs)
+        # With memoize_output, a composition of constant arguments and children
+        # is rendered once per output environment.
+        self.constant_output = (
+            output_memo is not None
+            and NOT_CONSTANT not in self.constant_args
+            and not self.variable_kwargs
+            and nodelist_is_constant(nodelist)
+            and all(nodelist_is_constant(slot) for slot in self.slots.values())
+        )
+        # The output memo is shared by all the usages of the tag: their outputs
+        # are keyed on their literal arguments, children and slots.
+        self.constant_key = (
+            make_constant_key(self.constant_args, self.constant_kwargs, nodelist, slots)
+            if self.constant_output
+            else None
+        )
+        # The variable kwargs the composed template reads, pruned once it is selected.
+        self.template_kwargs = self.variable_kwargs
+
+    def __getstate__(self):
+        # Pickled by compose_tags.loaders: the composed template is loaded again.
+        return {
+            **self.__dict__,
+            "composed_template": None,
+            "template_kwargs": self.variable_kwargs,
+        }
+
+    def render(self, context):
+        """
+        Same as InclusionNode.render, except that the template is held on the node
+        across renders.
+        """
+        compose_profile = get_active_profile()
+        if compose_profile is not None:
+            return self.render_profiled(context, compose_profile)
+        if self.constant_output:
+            return self.render_constant(context)
+        if self.output_memo is not None:
+            return self.render_memoized(context)
+        # Selected first: the arguments it doesn't read aren't resolved.
+        template = self.get_template(context)
+        _dict = self.get_composed_values(context)
+        return self.render_values(template, context, _dict)
+
+    def render_memoized(self, context):
+        """Render, or reuse the output of a previous render with the same values."""
+        template = self.get_template(context)
+        resolved_args, resolved_kwargs = self.get_resolved_arguments(context)
+        key = make_memo_key(resolved_args, resolved_kwargs)
+        output = None
+        if key is None:
+            _dict = self.call(resolved_args, resolved_kwargs)
+        else:
+            # The output also depends on the values copied from the context.
+            output_key = ("output", key, get_output_environment(context, template))
+            output = self.output_memo.get(output_key)
+            if output is None:
+                _dict = self.call_memoized(resolved_args, resolved_kwargs, key)
+        if output is None:
+            copy_csrf_token(context, _dict)
+            render_eager_children(template, _dict)
+            output = render_isolated(self, template, context, _dict)
+            if key is not None:
+                self.output_memo.set(output_key, output)
+        # Fingerprinted by the output, whether it is reused or not.
+        add_fingerprint(template, {"output": output}, context)
+        return output
+
+    def render_constant(self, context):
+        """
+        Render once per output environment, without resolving the arguments:
+        they are all constant.
+        """
+        template = self.get_template(context)
+        output_key = (
+            "constant",
+            self.constant_key,
+            get_output_environment(context, template),
+        )
+        output = self.output_memo.get(output_key)
+        if output is None:
+            output = self.render_memoized(context)
+            self.output_memo.set(output_key, output)
+        else:
+            add_fingerprint(template, {"output": output}, context)
+        return output
+
+    def render_profiled(self, context, compose_profile):
+        timings = Timings()
+        with timings.measure("template"):
+            template = self.get_template(context)
+        if self.output_memo is not None:
+            # Memoized outputs are resolved and rendered in one go, or reused.
+            with timings.measure("render"):
+                if self.constant_output:
+                    output = self.render_constant(context)
+                else:
+                    output = self.render_memoized(context)
+        else:
+            with timings.measure("arguments"):
+                _dict = self.get_composed_values(context, timings)
+            with timings.measure("render"):
+                output = self.render_values(template, context, _dict)
+        compose_profile.record(self.__class__, template, timings, len(output))
+        return output
+
+    def render_iter(self, context):
+        """Streaming equivalent of render, see compose_tags.streaming."""
+        template = self.get_template(context)
+        _dict = self.get_composed_values(context)
+        copy_csrf_token(context, _dict)
+        add_fingerprint(template, _dict, context)
+        render_eager_children(template, _dict, streaming=True)
+        yield from iter_template(template, context.new(_dict))
+
+    def get_composed_values(self, context, timings=None):
+        """Values of the composed template: the composition function's result."""
+        resolved_args, resolved_kwargs = self.get_resolved_arguments(context)
+        if timings is not None:
+            set_children_timings(resolved_args[:1], timings)
+            set_children_timings(resolved_kwargs.values(), timings)
+        if self.memo is not None:
+            key = make_memo_key(resolved_args, resolved_kwargs)
+            return self.call_memoized(resolved_args, resolved_kwargs, key)
+        return self.call(resolved_args, resolved_kwargs)
+
+    def call(self, resolved_args, resolved_kwargs):
+        if self.func is default_composition:
+            # Bind the values straight away, without a call.
+            resolved_kwargs["children"] = resolved_args[0]
+            return resolved_kwargs
+        # Composition functions get children and slots as strings.
+        render_lazy_arguments(resolved_args, resolved_kwargs)
+        if self.is_async:
+            from asgiref.sync import async_to_sync
+
+            return async_to_sync(self.func)(*resolved_args, **resolved_kwargs)
+        return self.func(*resolved_args, **resolved_kwargs)
+
+    def prepare_async(self, context):
+        """
+        Return the coroutine of the async composition function, and the function
+        rendering the template with its result. See compose_tags.asynchronous.
+        """
+        resolved_args, resolved_kwargs = self.get_resolved_arguments(context)
+        render_lazy_arguments(resolved_args, resolved_kwargs)
+
+        def finish(values):
+            return self.render_values(self.get_template(context), context, values)
+
+        return self.func(*resolved_args, **resolved_kwargs), finish
+
+    def call_memoized(self, resolved_args, resolved_kwargs, key):
+        if key is None:
+            return self.call(resolved_args, resolved_kwargs)
+        values = self.memo.get(key)
+        if values is None:
+            values = self.call(resolved_args, resolved_kwargs)
+            self.memo.set(key, values)
+        # The composed context uses the dict as a layer: keep the memo untouched.
+        return dict(values)
+
+    def render_values(self, template, context, values):
+        copy_csrf_token(context, values)
+        add_fingerprint(template, values, context)
+        render_eager_children(template, values)
+        return render_isolated(self, template, context, values)
+
+    def get_template(self, context):
+        template = self.composed_template
+        if template is None:
+            template = self.select_template(context.template.engine)
+            self.template_kwargs = self.get_template_kwargs(template)
+            self.composed_template = template
+        return template
+
+    def get_template_kwargs(self, template):
+        """
+        The variable kwargs template reads, see compose_tags.analysis. Only known
+        without a composition function: the template then receives the kwargs.
+        """
+        if self.func is not default_composition or self.takes_context:
+            return self.variable_kwargs
+        read = check_arguments(
+            self, template, get_passed_names(self.kwargs, self.nodelist, self.slots)
+        )
+        return {k: v for k, v in self.variable_kwargs.items() if k in read}
+
+    def select_template(self, engine):
+        if isinstance(self.filename, Template):
+            return self.filename
+        if isinstance(getattr(self.filename, "template", None), Template):
+            return self.filename.template
+        if isinstance(self.filename, str):
+            template_name = (self.filename,)
+        else:
+            template_name = tuple(self.filename)
+        return select_composed_template(engine, template_name)
 
     def get_resolved_arguments(self, context):
-        resolved_args, resolved_kwargs = super().get_resolved_arguments(context)
-        children = self.nodelist.render(context)
-        resolved_args = [children] + resolved_args
+        """
+        Same as TagHelperNode.get_resolved_arguments, with children as first
+        argument, built in a single pass.
+        """
+        # Children and slots are only rendered if the composed template uses them.
+        children = get_children(self.nodelist, context)
+        if self.takes_context:
+            resolved_args = [children, context]
+        else:
+            resolved_args = [children]
+        for var, value in zip(self.args, self.constant_args):
+            resolved_args.append(
+                var.resolve(context) if value is NOT_CONSTANT else value
+            )
+        resolved_kwargs = {
+            k: v.resolve(context) for k, v in self.template_kwargs.items()
+        }
+        resolved_kwargs.update(self.constant_kwargs)
+        if self.slots:
+            resolved_kwargs.update(self.get_slots(context))
         return resolved_args, resolved_kwargs
 
 
 class DefineNode(Node):
-    def __init__(self, target_var, nodelist):
+    """
+    Store the rendered nodelist in target_var.
+
+    lazy: store LazyChildren instead, rendered on first use with a snapshot of the
+    context at definition.
+    once: render on the first render of the node within the top-level template
+    render, and reuse that value on the next ones, e.g. in loops or in composed
+    templates rendered many times.
+    """
+
+    def __init__(self, target_var, nodelist, lazy=False, once=False):
         self.target_var = target_var
         self.nodelist = nodelist
+        self.lazy = lazy
+        self.once = once
+
+    def render(self, context):
+        if self.once:
+            # The first render context layer is shared by the whole render.
+            values = context.render_context.dicts[0]
+            if self in values:
+                value = values[self]
+            else:
+                value = values[self] = self.get_value(context)
+        else:
+            value = self.get_value(context)
+        context[self.target_var] = value
+        return ""
+
+    def get_value(self, context):
+        if self.lazy:
+            return get_children(self.nodelist, freeze_context(context))
+        return self.nodelist.render(context)
+
+
+class DefineForNode(Node):
+    """
+    Same as django.template.defaulttags.ForNode, except that each iteration is
+    stored in target_var as a list of rendered items instead of being output.
+
+    Tuned for long lists: the output list is preallocated, a single context layer
+    is pushed for the whole loop, and the forloop dict is only maintained when
+    the loop body may use it.
+    """
+
+    child_nodelists = ("nodelist_loop", "nodelist_empty")
+
+    def __init__(
+        self,
+        target_var,
+        loopvars,
+        sequence,
+        is_reversed,
+        nodelist_loop,
+        nodelist_empty=None,
+    ):
+        self.target_var = target_var
+        self.loopvars, self.sequence = loopvars, sequence
+        self.is_reversed = is_reversed
+        self.nodelist_loop = nodelist_loop
+        if nodelist_empty is None:
+            self.nodelist_empty = NodeList()
+        else:
+            self.nodelist_empty = nodelist_empty
+        self.uses_forloop = nodelist_uses_forloop(nodelist_loop)
+
+    def __repr__(self):
+        reversed_text = " reversed" if self.is_reversed else ""
+        return "<%s: %s, for %s in %s, tail_len: %d%s>" % (
+            self.__class__.__name__,
+            self.target_var,
+            ", ".join(self.loopvars),
+            self.sequence,
+            len(self.nodelist_loop),
+            reversed_text,
+        )
 
     def render(self, context):
-        context[self.target_var] = self.nodelist.render(context)
+        if "forloop" in context:
+            parentloop = context["forloop"]
+        else:
+            parentloop = {}
+
+        with context.push():
+            values = self.sequence.resolve(context, ignore_failures=True)
+            if values is None:
+                values = []
+            if not hasattr(values, "__len__"):
+                values = list(values)
+            len_values = len(values)
+            if len_values < 1:
+                list_value = [self.nodelist_empty.render(context)]
+            else:
+                list_value = [None] * len_values
+                if self.is_reversed:
+                    values = reversed(values)
+                loopvars = self.loopvars
+                num_loopvars = len(loopvars)
+                unpack = num_loopvars > 1
+                nodelist_loop = self.nodelist_loop
+                # Loop variables are written straight into the layer pushed above.
+                loop_context = context.dicts[-1]
+                if self.uses_forloop:
+                    loop_dict = loop_context["forloop"] = {"parentloop": parentloop}
+                else:
+                    loop_dict = None
+                for i, item in enumerate(values):
+                    if loop_dict is not None:
+                        loop_dict["counter0"] = i
+                        loop_dict["counter"] = i + 1
+                        loop_dict["revcounter"] = len_values - i
+                        loop_dict["revcounter0"] = len_values - i - 1
+                        loop_dict["first"] = i == 0
+                        loop_dict["last"] = i == len_values - 1
+
+                    if unpack:
+                        try:
+                            len_item = len(item)
+                        except TypeError:  # not an iterable
+                            len_item = 1
+                        # Check loop variable count before unpacking
+                        if num_loopvars != len_item:
+                            raise ValueError(
+                                "Need {} values to unpack in for loop; got {}. ".format(
+                                    num_loopvars, len_item
+                                ),
+                            )
+                        loop_context.update(zip(loopvars, item))
+                    else:
+                        loop_context[loopvars[0]] = item
+
+                    list_value[i] = SafeString(
+                        "".join(
+                            [node.render_annotated(context) for node in nodelist_loop]
+                        )
+                    )
+        context[self.target_var] = list_value
         return ""
 
 
-# class DefineForNode(Node):
-#    # copypasta of django.template.defaulttags.ForNode with small modifications for target_var
-#    child_nodelists = ("nodelist_loop", "nodelist_empty")
-#
-#    def __init__(
-#        self,
-#        target_var,
-#        loopvars,
-#        sequence,
-#        is_reversed,
-#        nodelist_loop,
-#        nodelist_empty=None,
-#    ):
-#        self.target_var = target_var  # divergence from ForNode
-#        self.loopvars, self.sequence = loopvars, sequence
-#        self.is_reversed = is_reversed
-#        self.nodelist_loop = nodelist_loop
-#        if nodelist_empty is None:
-#            self.nodelist_empty = NodeList()
-#        else:
-#            self.nodelist_empty = nodelist_empty
-#
-#    def __repr__(self):
-#        reversed_text = " reversed" if self.is_reversed else ""
-#        return "<%s: %s, for %s in %s, tail_len: %d%s>" % (
-#            self.__class__.__name__,
-#            self.target_var,  # divergence from ForNode
-#            ", ".join(self.loopvars),
-#            self.sequence,
-#            len(self.nodelist_loop),
-#            reversed_text,
-#        )
-#
-#    def render(self, context):
-#        list_value = []  # divergence from ForNode
-#
-#        if "forloop" in context:
-#            parentloop = context["forloop"]
-#        else:
-#            parentloop = {}
-#
-#        with context.push():
-#            values = self.sequence.resolve(context, ignore_failures=True)
-#            if values is None:
-#                values = []
-#            if not hasattr(values, "__len__"):
-#                values = list(values)
-#            len_values = len(values)
-#            if len_values < 1:
-#                list_value = [
-#                    self.nodelist_empty.render(context)
-#                ]  # divergence from ForNode
-#            else:  # divergence from ForNode
-#                if self.is_reversed:
-#                    values = reversed(values)
-#                num_loopvars = len(self.loopvars)
-#                unpack = num_loopvars > 1
-#                # Create a forloop value in the context.  We'll update counters on each
-#                # iteration just below.
-#                loop_dict = context["forloop"] = {"parentloop": parentloop}
-#                for i, item in enumerate(values):
-#                    nodelist = []  # divergence from ForNode
-#                    # Shortcuts for current loop iteration number.
-#                    loop_dict["counter0"] = i
-#                    loop_dict["counter"] = i + 1
-#                    # Reverse counter iteration numbers.
-#                    loop_dict["revcounter"] = len_values - i
-#                    loop_dict["revcounter0"] = len_values - i - 1
-#                    # Boolean values designating first and last times through loop.
-#                    loop_dict["first"] = i == 0
-#                    loop_dict["last"] = i == len_values - 1
-#
-#                    pop_context = False
-#                    if unpack:
-#                        # If there are multiple loop variables, unpack the item into
-#                        # them.
-#                        try:
-#                            len_item = len(item)
-#                        except TypeError:  # not an iterable
-#                            len_item = 1
-#                        # Check loop variable count before unpacking
-#                        if num_loopvars != len_item:
-#                            raise ValueError(
-#                                "Need {} values to unpack in for loop; got {}. ".format(
-#                                    num_loopvars, len_item
-#                                ),
-#                            )
-#                        unpacked_vars = dict(zip(self.loopvars, item))
-#                        pop_context = True
-#                        context.update(unpacked_vars)
-#                    else:
-#                        context[self.loopvars[0]] = item
-#
-#                    for node in self.nodelist_loop:
-#                        nodelist.append(node.render_annotated(context))
-#
-#                    if pop_context:
-#                        # Pop the loop variables pushed on to the context to avoid
-#                        # the context ending up in an inconsistent state when other
-#                        # tags (e.g., include and with) push data to context.
-#                        context.pop()
-#                    list_value.append(
-#                        mark_safe("".join(nodelist))
-#                    )  # divergence from ForNode
-#        context[self.target_var] = list_value  # divergence from ForNode
-#        return ""  # divergence from ForNode
-#
+def nodelist_uses_forloop(nodelist):
+    """
+    Whether the nodes may access forloop: they mention it, read it implicitly
+    (ifchanged), or hand over the context to another template (include, compose
+    with takes_context).
+    """
+    for node in nodelist.get_nodes_by_type(Node):
+        if isinstance(node, FORLOOP_NODES) or getattr(node, "takes_context", False):
+            return True
+        token = getattr(node, "token", None)
+        if token is None or "forloop" in token.contents:
+            return True
+    return False
+
+
+class ParallelNode(Node):
+    """
+    Render the compose and composition nodes of the nodelist concurrently in a
+    thread pool, and the other nodes in order.
+
+    Each composition gets a copy of the context with its own top layer. The
+    nodelist is rendered serially when reordering may be visible: define tags or
+    compositions taking the context, and within transactions.
+    """
+
+    def __init__(self, nodelist):
+        self.nodelist = nodelist
+        self.parallel = nodelist_is_parallel(nodelist)
+
+    def render(self, context):
+        if not self.parallel or in_worker() or in_atomic_block():
+            return self.nodelist.render(context)
+        parts = []
+        futures = []
+        for node in self.nodelist:
+            if isinstance(node, (ComposeNode, CompositionNode)):
+                task_context = copy(context)
+                task_context.render_context.push()
+                task_context.push()
+                futures.append(
+                    (len(parts), submit(node.render_annotated, task_context))
+                )
+                parts.append("")
+            else:
+                parts.append(node.render_annotated(context))
+        for index, future in futures:
+            parts[index] = future.result()
+        return SafeString("".join(parts))
+
+
+def nodelist_is_parallel(nodelist):
+    for node in nodelist.get_nodes_by_type(Node):
+        if isinstance(node, (DefineNode, DefineForNode)):
+            return False
+        if getattr(node, "takes_context", False):
+            return False
+    return True
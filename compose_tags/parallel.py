@@ -0,0 +1,64 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar, copy_context
+
+from django.db import close_old_connections, connections
+from django.utils import timezone, translation
+
+from compose_tags.conf import compose_settings
+
+_executor = None
+_executor_lock = threading.Lock()
+_in_worker = ContextVar("compose_tags_in_worker", default=False)
+
+
+def in_worker():
+    """
+    Whether we are rendering in the pool: nested parallel blocks render serially,
+    waiting on the pool from within it could exhaust it.
+    """
+    return _in_worker.get()
+
+
+def in_atomic_block():
+    """
+    Whether a transaction is open in this thread: worker threads have their own
+    database connections, they wouldn't see its uncommitted changes.
+    """
+    return any(connection.in_atomic_block for connection in connections.all())
+
+
+def get_executor():
+    """Thread pool shared by all {% parallel %} blocks, created on first use."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=compose_settings.PARALLEL_WORKERS,
+                    thread_name_prefix="compose_tags",
+                )
+    return _executor
+
+
+def submit(func, *args):
+    """
+    Run func in the pool, with the caller's context variables (profiling...),
+    active language and current time zone.
+    """
+    language = translation.get_language()
+    time_zone = timezone.get_current_timezone()
+    return get_executor().submit(
+        copy_context().run, run_task, language, time_zone, func, *args
+    )
+
+
+def run_task(language, time_zone, func, *args):
+    _in_worker.set(True)
+    try:
+        with translation.override(language), timezone.override(time_zone):
+            return func(*args)
+    finally:
+        # Same as at the end of a request: worker threads must not keep
+        # database connections past CONN_MAX_AGE.
+        close_old_connections()
@@ -0,0 +1,110 @@
+"""
+Opt-in render profiling of compose and composition tags.
+
+Profiling is active within `profile()`, or for each request with
+compose_tags.middleware.ComposeProfileMiddleware:
+
+    with profile() as compose_profile:
+        render_to_string("page.html")
+    compose_profile.summary()
+
+Each composed template render is recorded under the composed template name and
+sent with the `component_rendered` signal. Time is split into:
+
+- template: template lookup,
+- arguments: resolution of the keyword arguments, and the composition function,
+- render: render of the composed template, children and slots included,
+- children: render of the children and slots.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.dispatch import Signal
+
+# Sent with name, timings and size arguments, while profiling is active.
+component_rendered = Signal()
+
+_active_profile = ContextVar("compose_tags_profile", default=None)
+
+
+def get_active_profile():
+    return _active_profile.get()
+
+
+@contextmanager
+def profile():
+    compose_profile = Profile()
+    token = _active_profile.set(compose_profile)
+    try:
+        yield compose_profile
+    finally:
+        _active_profile.reset(token)
+
+
+class Timings:
+    """Seconds spent in each step of a single render."""
+
+    __slots__ = ("template", "arguments", "render", "children")
+
+    def __init__(self):
+        self.template = 0.0
+        self.arguments = 0.0
+        self.render = 0.0
+        self.children = 0.0
+
+    def __repr__(self):
+        return "<%s: %s>" % (
+            self.__class__.__name__,
+            " ".join(
+                "%s=%.6f" % (step, getattr(self, step)) for step in self.__slots__
+            ),
+        )
+
+    @contextmanager
+    def measure(self, step):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            setattr(self, step, getattr(self, step) + perf_counter() - start)
+
+
+class ComponentStats(Timings):
+    """Cumulated timings, call count and output size of a component."""
+
+    __slots__ = ("calls", "size")
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+        self.size = 0
+
+    def add(self, timings, size):
+        self.calls += 1
+        self.size += size
+        for step in Timings.__slots__:
+            setattr(self, step, getattr(self, step) + getattr(timings, step))
+
+
+class Profile:
+    def __init__(self):
+        self.components = defaultdict(ComponentStats)
+        # Components may be rendered in parallel, see {% parallel %}.
+        self._lock = threading.Lock()
+
+    def record(self, sender, template, timings, size):
+        name = template.origin.template_name or template.origin.name
+        with self._lock:
+            self.components[name].add(timings, size)
+        component_rendered.send(sender=sender, name=name, timings=timings, size=size)
+
+    def summary(self):
+        """Components stats, the most expensive first."""
+        return sorted(
+            self.components.items(),
+            key=lambda item: item[1].render + item[1].arguments + item[1].template,
+            reverse=True,
+        )
@@ -0,0 +1,90 @@
+"""
+Generator based rendering, to send composed pages with a StreamingHttpResponse:
+
+    def view(request):
+        template = get_template("page.html")
+        return StreamingHttpResponse(stream_template(template, {...}, request))
+
+Compose and composition nodes found in the streamed nodelists yield their output
+in chunks, their children being streamed where the composed template outputs
+`{{ children }}`. Any other node, including `{% extends %}`, `{% if %}` or
+`{% for %}`, yields its output as a single chunk.
+"""
+from django.template import Context, Variable
+from django.template.base import VariableNode
+from django.template.context import make_context
+from django.utils.safestring import SafeString
+
+
+def iter_nodelist(nodelist, context):
+    for node in nodelist:
+        render_iter = getattr(node, "render_iter", None)
+        if render_iter is not None:
+            yield from render_iter(context)
+            continue
+        value = get_streamable_value(node, context)
+        if value is not None:
+            yield from value.iter_chunks()
+            continue
+        chunk = node.render_annotated(context)
+        if chunk:
+            yield chunk
+
+
+def get_output_name(node):
+    """The name of the variable output by a `{{ name }}` node, None for other nodes."""
+    if not isinstance(node, VariableNode):
+        return None
+    filter_expression = node.filter_expression
+    var = filter_expression.var
+    if (
+        filter_expression.filters
+        or not isinstance(var, Variable)
+        or var.lookups is None
+    ):
+        return None
+    if len(var.lookups) != 1:
+        return None
+    return var.var
+
+
+def get_streamable_value(node, context):
+    """Return the streamable value output by a `{{ name }}` node, if any."""
+    name = get_output_name(node)
+    if name is None:
+        return None
+    value = context.get(name)
+    return value if hasattr(value, "iter_chunks") else None
+
+
+def iter_template(template, context):
+    """Stream a template rendered from within another template's render."""
+    with context.render_context.push_state(template):
+        yield from iter_nodelist(template.nodelist, context)
+
+
+def stream_template(template, context=None, request=None):
+    """
+    Streaming equivalent of template.render(context, request), for both the
+    django backend's templates and django.template.Template.
+    """
+    if hasattr(template, "backend"):
+        context = make_context(
+            context, request, autoescape=template.backend.engine.autoescape
+        )
+        template = template.template
+    elif not isinstance(context, Context):
+        context = Context(context)
+    with context.render_context.push_state(template):
+        with context.bind_template(template):
+            context.template_name = template.name
+            yield from iter_nodelist(template.nodelist, context)
+
+
+def render_chunks(template, context=None, request=None):
+    """
+    Equivalent of template.render(context, request) joining the output once: the
+    children of compose and composition nodes are embedded as chunks instead of
+    being joined into a string at each nesting level.
+    """
+    return SafeString("".join(stream_template(template, context, request)))
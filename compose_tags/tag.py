@@ -1,15 +1,49 @@
+import asyncio
 import functools
 from inspect import getfullargspec, unwrap
 
 from django.template import TemplateSyntaxError
+from django.template.base import NodeList
 from django.template.library import parse_bits
 
-from compose_tags.node import CompositionNode
+from compose_tags.cache import LRUCache
+from compose_tags.conf import compose_settings
+from compose_tags.minify import minify_nodelist
+from compose_tags.node import CompositionNode, default_composition
 
 
-def default_composition(children, **kwargs):
-    kwargs["children"] = children
-    return kwargs
+def parse_children(parser, name):
+    """
+    Parse the content of a composition tag until its end tag.
+
+    Returns the children nodelist and the nodelists of the named slots:
+    {% slot name %}...{% endslot %} blocks found at the top level of the children.
+    """
+    end_tag = f"end{name}"
+    children = NodeList()
+    slots = {}
+    while True:
+        for node in parser.parse(("slot", end_tag)):
+            children.append(node)
+        token = parser.next_token()
+        if token.contents == end_tag:
+            if compose_settings.MINIFY:
+                for nodelist in (children, *slots.values()):
+                    minify_nodelist(nodelist)
+            return children, slots
+        bits = token.split_contents()
+        if len(bits) != 2:
+            raise TemplateSyntaxError(
+                "slot tag takes exactly one argument: the name of the slot. "
+                "Eg: {% slot footer %}value{% endslot %}"
+            )
+        slot_name = bits[1]
+        if slot_name == "children" or slot_name in slots:
+            raise TemplateSyntaxError(
+                "%r received slot %r multiple times." % (name, slot_name)
+            )
+        slots[slot_name] = parser.parse(("endslot",))
+        parser.delete_first_token()
 
 
 def parse_bits_with_children(
@@ -55,9 +89,73 @@ def parse_bits_with_children(
     )
 
 
+def get_compile_func(
+    func, filename, takes_context, memoize=False, maxsize=128, memoize_output=False
+):
+    """Return the compilation function of a composition tag, the argspec being read once."""
+    if (memoize or memoize_output) and asyncio.iscoroutinefunction(func):
+        raise ValueError("Async composition tags can't be memoized.")
+    memo = LRUCache(maxsize) if memoize or memoize_output else None
+    # Outputs have their own LRU cache: they don't evict the memoized values.
+    output_memo = LRUCache(maxsize) if memoize_output else None
+    (
+        params,
+        varargs,
+        varkw,
+        defaults,
+        kwonly,
+        kwonly_defaults,
+        _,
+    ) = getfullargspec(unwrap(func))
+
+    @functools.wraps(func)
+    def compile_func(parser, token):
+        name, *bits = token.split_contents()
+        nodelist, slots = parse_children(parser, name)
+        # Slots are keyword arguments given as nodelists: have them validated
+        # by parse_bits, like any other keyword argument, then drop them.
+        args, kwargs = parse_bits_with_children(
+            parser,
+            bits + [f"{slot_name}=None" for slot_name in slots],
+            params,
+            varargs,
+            varkw,
+            defaults,
+            kwonly,
+            kwonly_defaults,
+            takes_context,
+            name,
+        )
+        for slot_name in slots:
+            del kwargs[slot_name]
+
+        return CompositionNode(
+            func,
+            takes_context,
+            args,
+            kwargs,
+            filename,
+            nodelist,
+            slots,
+            memo,
+            output_memo,
+        )
+
+    # Read by compose_tags.graph, compose_tags.loaders and compose_tags.batch.
+    compile_func.composition_func = func
+    compile_func.composition_filename = filename
+    compile_func.composition_takes_context = takes_context
+    compile_func.memo = memo
+    compile_func.output_memo = output_memo
+    return compile_func
+
+
 def composition_tag(
     filename,
     takes_context=False,
+    memoize=False,
+    maxsize=128,
+    memoize_output=False,
 ):
     """
     Register a callable as a composition tag:
@@ -69,46 +167,38 @@ def composition_tag(
             "children": children,
             "footer": footer or default_footer,
         }
-    """
 
-    def dec(func_or_parser, token=None):
-        func = default_composition if token else func_or_parser
-        (
-            params,
-            varargs,
-            varkw,
-            defaults,
-            kwonly,
-            kwonly_defaults,
-            _,
-        ) = getfullargspec(unwrap(func))
-
-        @functools.wraps(func)
-        def compile_func(parser, token):
-            name, *bits = token.split_contents()
-            args, kwargs = parse_bits_with_children(
-                parser,
-                bits,
-                params,
-                varargs,
-                varkw,
-                defaults,
-                kwonly,
-                kwonly_defaults,
-                takes_context,
-                name,
-            )
-            nodelist = parser.parse((f"end{name}",))
-            parser.next_token()
+    The function can be a coroutine function, see compose_tags.asynchronous.
 
-            return CompositionNode(
-                func, takes_context, args, kwargs, filename, nodelist
-            )
+    Pure functions can be memoized with memoize=True: their result is cached per
+    children and arguments in a LRU cache of maxsize entries. Calls with arguments
+    of other types than immutable primitives aren't cached, see make_memo_key.
+    memoize_output=True also caches the rendered output, in another LRU cache.
+    """
+    if (memoize or memoize_output) and takes_context:
+        raise ValueError("Composition tags taking the context can't be memoized.")
+    options = {
+        "memoize": memoize,
+        "maxsize": maxsize,
+        "memoize_output": memoize_output,
+    }
 
+    default_compile_func = None
+
+    def dec(func_or_parser, token=None):
+        nonlocal default_compile_func
         if token:
-            return compile_func(func_or_parser, token)
-        return compile_func
+            # Used without a function: the tag function is compiled once.
+            if default_compile_func is None:
+                default_compile_func = get_compile_func(
+                    default_composition, filename, takes_context, **options
+                )
+            return default_compile_func(func_or_parser, token)
+        return get_compile_func(func_or_parser, filename, takes_context, **options)
 
     dec.__name__ = ".".join(filename.split("/")[-1].split(".")[:-1])
+    dec.composition_func = default_composition
+    dec.composition_filename = filename
+    dec.composition_takes_context = takes_context
 
     return dec
@@ -55,6 +55,7 @@ setup(
     packages=find_packages(exclude=["tests*"]),
     include_package_data=True,
     install_requires=["Django>=2.2"],
+    extras_require={"jinja2": ["Jinja2>=3.0"]},
     python_requires=">=3.6",
     zip_safe=False,
     classifiers=[
@@ -6,6 +6,7 @@ def pytest_configure(config):
 
     settings.configure(
         DEBUG_PROPAGATE_EXCEPTIONS=True,
+        SECRET_KEY="compose_tags",
         DATABASES={
             "default": {
                 "ENGINE": "django.db.backends.sqlite3",
@@ -7,6 +7,7 @@ register = Library()
 
 register.tag(composition_tag("composition/test_csrf.html"))
 register.tag("children", composition_tag("composition/button.html"))
+register.tag("default_card", composition_tag("composition/card.html"))
 
 
 @register.tag
@@ -49,3 +50,74 @@ def with_kwargs(children, disabled):
         "disabled": disabled,
         "children": children,
     }
+
+
+@register.tag
+@composition_tag("composition/card.html", takes_context=True)
+def mixed_arguments(children, context, title, footer="", **kwargs):
+    values = " ".join("%s=%s" % item for item in sorted(kwargs.items()))
+    return {
+        "children": children,
+        "title": title,
+        "footer": "%s %s %s" % (context["name"], footer, values),
+    }
+
+
+@register.tag
+@composition_tag("composition/button.html")
+def stripped(children):
+    return {"children": children.strip()}
+
+
+@register.tag
+@composition_tag("composition/card.html")
+def card(children, footer, title="Title"):
+    return {"children": children, "footer": footer, "title": title}
+
+
+memoized_calls = []
+
+
+@register.tag
+@composition_tag("composition/button.html", memoize=True)
+def memoized(children, disabled=False):
+    memoized_calls.append((children, disabled))
+    return {"children": children, "disabled": disabled}
+
+
+@register.tag
+@composition_tag("composition/button.html", memoize_output=True)
+def memoized_output(children, disabled=False):
+    return {"children": children, "disabled": disabled}
+
+
+@register.tag
+@composition_tag("composition/time.html", memoize_output=True)
+def memoized_time(children, value):
+    return {"children": children, "value": value}
+
+
+@register.tag
+@composition_tag("composition/button.html")
+async def async_button(children, rendezvous=None):
+    if rendezvous is not None:
+        await rendezvous.wait()
+    return {"children": children}
+
+
+@register.tag
+@composition_tag("composition/button.html")
+def slow_button(children, barrier=None):
+    if barrier is not None:
+        barrier.wait()
+    return {"children": children}
+
+
+@register.tag
+@composition_tag("composition/button.html")
+def string_children(children):
+    capitalized = "".join([children[:1].upper(), children[1:]])
+    return {
+        "children": "%s|%s|%s"
+        % (capitalized, "{:>5}".format(children), isinstance(children, str))
+    }
@@ -1,8 +1,36 @@
+import asyncio
+import datetime
 import os
+import re
+import threading
 
 import pytest
-from django.template import TemplateSyntaxError
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import transaction
+from django.http import HttpResponse
+from django.template import Context, Engine, TemplateSyntaxError, engines
+from django.template.backends.django import DjangoTemplates
 from django.template.loader import get_template, render_to_string
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone, translation
+from django.utils.safestring import mark_safe
+
+import compose_tags.node
+from compose_tags import composition_tag
+from compose_tags.analysis import get_template_variables
+from compose_tags.asynchronous import arender
+from compose_tags.batch import iter_many, render_many
+from compose_tags.cache import fragment_cache_stats
+from compose_tags.children import ChildrenBudgetExceeded, get_children_allocations
+from compose_tags.fingerprint import fingerprint
+from compose_tags.graph import build_graph
+from compose_tags.middleware import ComposeETagMiddleware, ComposeProfileMiddleware
+from compose_tags.node import CompositionNode, default_composition
+from compose_tags.profiling import component_rendered, profile
+from compose_tags.streaming import render_chunks, stream_template
+from tests.templatetags.composition_test import card, memoized_calls, takes_context
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
@@ -16,11 +44,37 @@ def format_html(html):
     return "".join([line.strip() for line in html.split("\n")])
 
 
+def collapse_html(html):
+    """Whitespace runs of html collapsed to a space, removed between tags."""
+    return re.sub(r"> <", "><", " ".join(html.split()))
+
+
 def read_expected(template_name):
     with open(os.path.join(dir_path, "expected", template_name), "r") as f:
         return f.read()
 
 
+def make_engine(loader="django.template.loaders.cached.Loader"):
+    """A new engine, for templates compiled with the current settings."""
+    return DjangoTemplates(
+        {
+            "NAME": "test",
+            "DIRS": [],
+            "APP_DIRS": False,
+            "OPTIONS": {
+                "debug": True,
+                "loaders": [
+                    (loader, ["django.template.loaders.app_directories.Loader"])
+                ],
+            },
+        }
+    )
+
+
+def make_persistent_engine():
+    return make_engine("compose_tags.loaders.PersistentLoader")
+
+
 def gather_autotest_templates(autotest_folder: str):
     return [
         (os.path.join(autotest_folder, f), f)
@@ -38,16 +92,38 @@ def gather_autotest_templates(autotest_folder: str):
         for template_name, filename in gather_autotest_templates("autotest")
     ),
 )
-def test_autotest_template(template_name, template_expected):
-    rendered = render_to_string(
-        template_name,
-        context={
-            "context_variable": "Context variable value",
-            "csrf_token": "test_csrf",
-        },
-    )
-    expected = get_template(template_expected)
-    assert format_html(rendered) == format_html(expected.template.source)
+@pytest.mark.parametrize("mode", ("render", "stream", "persistent", "minify"))
+def test_autotest_template(template_name, template_expected, mode, tmp_path):
+    context = {
+        "context_variable": "Context variable value",
+        "csrf_token": "test_csrf",
+        "pairs": [("a", 1), ("b", 2)],
+    }
+    with override_settings(
+        COMPOSE_TAGS={
+            "COMPILED_TEMPLATES_DIR": str(tmp_path),
+            "MINIFY": mode == "minify",
+        }
+    ):
+        if mode == "stream":
+            rendered = "".join(stream_template(get_template(template_name), context))
+        elif mode == "persistent":
+            # The first engine compiles and saves templates, the second loads them.
+            make_persistent_engine().get_template(template_name)
+            template = make_persistent_engine().get_template(template_name)
+            rendered = template.render(context)
+        elif mode == "minify":
+            rendered = make_engine().get_template(template_name).render(context)
+        else:
+            rendered = render_to_string(template_name, context=context)
+    if mode == "minify":
+        # format_html drops the line breaks the minified output collapses to a
+        # space: compare with the template rendered as is instead.
+        expected = render_to_string(template_name, context=context)
+        assert collapse_html(rendered) == collapse_html(expected)
+    else:
+        expected = get_template(template_expected).template.source
+        assert format_html(rendered) == format_html(expected)
 
 
 # TODO: check error message. Where the exception come from is not tested
@@ -63,3 +139,919 @@ def test_autotest_template(template_name, template_expected):
 def test_autotest_template_syntax_error(template_name):
     with pytest.raises(TemplateSyntaxError):
         render_to_string(template_name)
+
+
+def test_compose_cache_stats():
+    template = engines["django"].from_string(
+        '{% load compose %}{% compose "composed.html" cache=60 variable=value %}'
+        "{{ value }}{% endcompose %}"
+    )
+    fragment_cache_stats.reset()
+    first = template.render({"value": "stats"})
+    second = template.render({"value": "stats"})
+    other = template.render({"value": "other stats"})
+    assert first == second
+    assert "var:other stats" in other
+    assert (fragment_cache_stats.hits, fragment_cache_stats.misses) == (1, 2)
+
+
+def test_compose_cache_csrf_token(rf):
+    template = engines["django"].from_string(
+        '{% load compose %}{% compose "composed.html" cache=60 variable="a" %}'
+        "{% endcompose %}"
+    )
+    csrf_template = engines["django"].from_string(
+        '{% load compose %}{% compose "csrf.html" cache=60 %}{% endcompose %}'
+    )
+    fragment_cache_stats.reset()
+    # The token is masked differently on each request, templates that don't read
+    # it don't vary on it, nor generate it.
+    for _ in range(2):
+        request = rf.get("/")
+        template.render({}, request)
+        assert not any(key.startswith("CSRF_COOKIE") for key in request.META)
+    assert (fragment_cache_stats.hits, fragment_cache_stats.misses) == (1, 1)
+
+    fragment_cache_stats.reset()
+    first_request = rf.get("/")
+    first = csrf_template.render({}, first_request)
+    same_user = rf.get("/")
+    same_user.META["CSRF_COOKIE"] = first_request.META["CSRF_COOKIE"]
+    assert csrf_template.render({}, same_user) == first
+    assert csrf_template.render({}, rf.get("/")) != first
+    assert (fragment_cache_stats.hits, fragment_cache_stats.misses) == (1, 2)
+
+
+def test_compose_cache_output_environment():
+    template = engines["django"].from_string(
+        '{% load compose %}{% compose "composition/translated.html" cache=60 '
+        "value=value %}{% endcompose %}"
+        "{% autoescape off %}"
+        '{% compose "composition/translated.html" cache=60 value=value %}'
+        "{% endcompose %}"
+        "{% endautoescape %}"
+    )
+    assert template.render({"value": "<b>"}) == ("January &lt;b&gt;\nJanuary <b>\n")
+    with translation.override("fr"):
+        assert template.render({"value": "<b>"}) == ("janvier &lt;b&gt;\njanvier <b>\n")
+
+
+class Article:
+    def __init__(self, pk, title):
+        self.pk = pk
+        self.title = title
+
+    def __str__(self):
+        return "Article %s" % self.pk
+
+    # Like model instances.
+    def __eq__(self, other):
+        return isinstance(other, Article) and self.pk == other.pk
+
+    def __hash__(self):
+        return hash(self.pk)
+
+
+class VersionedArticle(Article):
+    def compose_key(self):
+        return (self.pk, self.title)
+
+
+def test_compose_cache_unstable_values():
+    template = engines["django"].from_string(
+        '{% load compose %}{% compose "composed.html" cache=60 variable=article %}'
+        "{{ article.title }}{% endcompose %}"
+    )
+    fragment_cache_stats.reset()
+    # Equal strings, different content: not cached.
+    assert "child:a" in template.render({"article": Article(1, "a")})
+    assert "child:b" in template.render({"article": Article(1, "b")})
+    assert (fragment_cache_stats.hits, fragment_cache_stats.misses) == (0, 0)
+
+    assert "child:a" in template.render({"article": VersionedArticle(1, "a")})
+    assert "child:b" in template.render({"article": VersionedArticle(1, "b")})
+    assert "child:b" in template.render({"article": VersionedArticle(1, "b")})
+    assert (fragment_cache_stats.hits, fragment_cache_stats.misses) == (1, 2)
+
+
+def test_constant_template_held_on_node(monkeypatch):
+    template = engines["django"].from_string(
+        '{% load compose %}{% compose "composed.html" %}{% endcompose %}'
+    )
+    template.render({})
+    selected = []
+    monkeypatch.setattr(
+        "compose_tags.node.select_composed_template",
+        lambda *args: selected.append(args),
+    )
+    template.render({})
+    assert selected == []
+
+
+def test_stream_template_chunks():
+    template = engines["django"].from_string(
+        '{% load compose %}<main>{% compose "composed.html" variable="a" %}'
+        "<p>{{ value }}</p>{% endcompose %}</main>"
+    )
+    chunks = list(stream_template(template, {"value": "streamed"}))
+    assert chunks[:3] == ["<main>", "var:", "a"]
+    assert "streamed" in chunks
+    assert "".join(chunks) == template.render({"value": "streamed"})
+
+
+@pytest.mark.parametrize(
+    "body,uses_forloop",
+    (
+        ("{{ item }}", False),
+        ("{% if item %}{{ item|upper }}{% endif %}", False),
+        ("{% if forloop.first %}{{ item }}{% endif %}", True),
+        ('{% include "composed.html" %}', True),
+        ("{% ifchanged %}{{ item }}{% endifchanged %}", True),
+    ),
+)
+def test_define_for_uses_forloop(body, uses_forloop):
+    template = engines["django"].from_string(
+        "{% load compose %}{% definelist items for item in list %}"
+        + body
+        + "{% enddefinelist %}"
+    )
+    node = template.template.nodelist[-1]
+    assert node.uses_forloop == uses_forloop
+
+
+def test_define_for_ifchanged():
+    template = engines["django"].from_string(
+        "{% load compose %}{% for group in groups %}"
+        "{% definelist items for item in group %}"
+        "{% ifchanged %}{{ item }}{% endifchanged %}{% enddefinelist %}"
+        "[{{ items|join:',' }}]{% endfor %}"
+    )
+    assert template.render({"groups": [[1, 2], [2, 3]]}) == "[1,2][2,3]"
+
+
+def test_profile_components():
+    received = []
+
+    def receiver(sender, name, timings, size, **kwargs):
+        received.append((sender, name, size))
+
+    component_rendered.connect(receiver)
+    try:
+        with profile() as compose_profile:
+            render_to_string("autotest/test_composition_slots.html")
+            render_to_string("autotest/test_composition_slots.html")
+    finally:
+        component_rendered.disconnect(receiver)
+    render_to_string("autotest/test_composition_slots.html")
+
+    [(name, stats)] = compose_profile.summary()
+    assert name == "composition/card.html"
+    assert stats.calls == 2
+    assert stats.size == 2 * len(
+        "<article><h1>Slots</h1>Body<footer>Footer</footer></article>"
+    )
+    assert 0 < stats.children <= stats.render
+    assert received == [(CompositionNode, name, stats.size / 2)] * 2
+
+
+def test_profile_middleware(rf):
+    def view(request):
+        return HttpResponse(render_to_string("autotest/test_compose_slots.html"))
+
+    response = ComposeProfileMiddleware(view)(rf.get("/"))
+    assert response["Server-Timing"].startswith(
+        'compose;desc="composition/card.html";dur='
+    )
+
+
+def test_memoized_composition():
+    template = engines["django"].from_string(
+        "{% load composition_test %}"
+        "{% memoized disabled=disabled %}{{ label }}{% endmemoized %}"
+    )
+    memoized_calls.clear()
+    assert template.render({"label": "a"}) == "<button>a</button>"
+    assert template.render({"label": "a"}) == "<button>a</button>"
+    assert template.render({"label": "b", "disabled": True}) == (
+        "<button disabled>b</button>"
+    )
+    # Arguments other than immutable primitives aren't cached
+    template.render({"label": "a", "disabled": []})
+    template.render({"label": "a", "disabled": []})
+    article = Article(1, "a")
+    template.render({"label": "a", "disabled": article})
+    template.render({"label": "a", "disabled": article})
+    assert memoized_calls == [
+        ("a", ""),
+        ("b", True),
+        ("a", []),
+        ("a", []),
+        ("a", article),
+        ("a", article),
+    ]
+
+
+def test_memoized_composition_output():
+    template = engines["django"].from_string(
+        "{% load composition_test %}"
+        "{% memoized_output %}{{ label }}{% endmemoized_output %}"
+    )
+    node = template.template.nodelist[-1]
+    for memo in (node.memo, node.output_memo):
+        memo.clear()
+        memo.stats.reset()
+    assert template.render({"label": "a"}) == "<button>a</button>"
+    assert template.render({"label": "a"}) == "<button>a</button>"
+    assert template.render({"label": "b"}) == "<button>b</button>"
+    assert (node.output_memo.stats.hits, len(node.output_memo)) == (1, 2)
+    assert len(node.memo) == 2
+
+
+def test_memoized_composition_output_profiled():
+    template = engines["django"].from_string(
+        "{% load composition_test %}"
+        "{% memoized_output %}{{ label }}{% endmemoized_output %}"
+        "{% memoized_output %}a{% endmemoized_output %}"
+    )
+    # Shared by the usages of the tag.
+    output_memo = template.template.nodelist[-1].output_memo
+    output_memo.clear()
+    with profile() as compose_profile:
+        template.render({"label": "a"})
+        hits, misses = output_memo.stats.hits, output_memo.stats.misses
+        assert template.render({"label": "a"}) == "<button>a</button>" * 2
+    # The second render reuses the outputs of the first one.
+    assert output_memo.stats.hits == hits + 2
+    assert output_memo.stats.misses == misses
+    [(name, stats)] = compose_profile.summary()
+    assert (name, stats.calls) == ("composition/button.html", 4)
+
+
+def test_memoized_composition_output_csrf_token(rf):
+    template = engines["django"].from_string(
+        "{% load composition_test %}"
+        "{% memoized_output %}{{ label }}{% endmemoized_output %}"
+    )
+    node = template.template.nodelist[-1]
+    node.output_memo.clear()
+    node.output_memo.stats.reset()
+    # The CSRF token of each request isn't part of the output key.
+    for _ in range(2):
+        request = rf.get("/")
+        assert template.render({"label": "a"}, request) == "<button>a</button>"
+        assert not any(key.startswith("CSRF_COOKIE") for key in request.META)
+    assert node.output_memo.stats.hits == 1
+
+
+def test_memoized_composition_output_time_zone():
+    template = engines["django"].from_string(
+        "{% load composition_test %}{% memoized_time value %}{% endmemoized_time %}"
+    )
+    value = datetime.datetime(2022, 1, 1, 12, tzinfo=datetime.timezone.utc)
+    with override_settings(USE_TZ=True):
+        with timezone.override("UTC"):
+            assert template.render({"value": value}) == "<time>12:00</time>\n"
+        with timezone.override("Asia/Tokyo"):
+            assert template.render({"value": value}) == "<time>21:00</time>\n"
+
+
+def test_constant_composition_output():
+    template = engines["django"].from_string(
+        "{% load composition_test %}"
+        "{% memoized_output disabled=True %}Label{% endmemoized_output %}"
+    )
+    node = template.template.nodelist[-1]
+    assert node.constant_output
+    node.output_memo.clear()
+    node.output_memo.stats.reset()
+    assert template.render({}) == "<button disabled>Label</button>"
+    assert template.render({"label": "b"}) == "<button disabled>Label</button>"
+    assert node.output_memo.stats.hits == 1
+
+    # Other usages of the tag share the output memo, not their outputs.
+    template = engines["django"].from_string(
+        "{% load composition_test %}"
+        "{% memoized_output disabled=True %}Label{% endmemoized_output %}"
+        "{% memoized_output disabled=False %}Label{% endmemoized_output %}"
+        "{% memoized_output disabled=1 %}Label{% endmemoized_output %}"
+        "{% memoized_output disabled=True %}Other{% endmemoized_output %}"
+    )
+    assert template.render({}) == (
+        "<button disabled>Label</button><button>Label</button>"
+        "<button disabled>Label</button><button disabled>Other</button>"
+    )
+    assert node.output_memo.stats.hits == 2
+
+
+def test_memoized_composition_takes_context():
+    with pytest.raises(ValueError):
+        composition_tag("composition/button.html", takes_context=True, memoize=True)
+
+
+class AsyncRendezvous:
+    """
+    Hold the coroutines waiting on it until `parties` of them wait at once, raise
+    asyncio.TimeoutError if they don't: they are awaited one after the other.
+    """
+
+    def __init__(self, parties, timeout=5):
+        self.parties = parties
+        self.timeout = timeout
+        self.waiting = 0
+        self.event = None
+
+    async def wait(self):
+        if self.event is None:
+            self.event = asyncio.Event()
+        self.waiting += 1
+        if self.waiting == self.parties:
+            self.event.set()
+        await asyncio.wait_for(self.event.wait(), self.timeout)
+
+
+def test_arender_gathers_async_compositions():
+    template = engines["django"].from_string(
+        "{% load compose composition_test %}"
+        "{% async_button rendezvous=top %}{{ label }}{% endasync_button %}"
+        '{% compose "composition/card.html" title=label %}'
+        "{% async_button rendezvous=nested %}{{ label }}{% endasync_button %}"
+        "{% async_button rendezvous=nested %}{{ label }}{% endasync_button %}"
+        "{% endcompose %}"
+        "{% async_button rendezvous=top %}{{ label }}{% endasync_button %}"
+        "{% define label %}changed{% enddefine %}"
+    )
+    # Two rounds, each awaiting its async compositions together: the top level
+    # tags, then the ones in the card's children.
+    context = {"label": "a", "top": AsyncRendezvous(2), "nested": AsyncRendezvous(2)}
+    rendered = asyncio.run(arender(template, context))
+    assert rendered == (
+        "<button>a</button>"
+        "<article><h1>a</h1><button>a</button><button>a</button><footer></footer></article>"
+        "<button>a</button>"
+    )
+
+
+def test_arender_template_rendered():
+    template = get_template("async.html")
+    with SimpleTestCase().assertTemplateUsed("composition/button.html"):
+        with SimpleTestCase().assertTemplateUsed("composition/card.html"):
+            asyncio.run(arender(template, {"label": "a"}))
+
+
+def test_parallel_renders_concurrently():
+    template = engines["django"].from_string(
+        "{% load compose composition_test %}{% parallel %}"
+        + "{% slow_button barrier=barrier %}{{ label }}{% endslow_button %}" * 4
+        + "{% endparallel %}"
+    )
+    assert template.template.nodelist[-1].parallel
+    # Only released once the 4 compositions are rendering at once, broken after
+    # the timeout if they are rendered one after the other.
+    barrier = threading.Barrier(4, timeout=5)
+    rendered = template.render({"label": "a", "barrier": barrier})
+    assert rendered == "<button>a</button>" * 4
+
+
+def test_parallel_translation_and_timezone():
+    template = engines["django"].from_string(
+        "{% load compose composition_test i18n tz %}{% parallel %}"
+        + '{% slow_button %}{% trans "January" %} '
+        "{% get_current_timezone as tz %}{{ tz }}{% endslow_button %}" * 2
+        + "{% endparallel %}"
+    )
+    assert template.template.nodelist[-1].parallel
+    with translation.override("fr"), timezone.override("Europe/Paris"):
+        rendered = template.render()
+    assert rendered == "<button>janvier Europe/Paris</button>" * 2
+
+
+@pytest.mark.django_db
+def test_parallel_atomic_block(monkeypatch):
+    template = engines["django"].from_string(
+        "{% load compose composition_test %}{% parallel %}"
+        + "{% slow_button %}{{ label }}{% endslow_button %}" * 2
+        + "{% endparallel %}"
+    )
+    monkeypatch.setattr("compose_tags.node.submit", None)
+    with transaction.atomic():
+        rendered = template.render({"label": "a"})
+    assert rendered == "<button>a</button>" * 2
+
+
+@pytest.mark.parametrize(
+    "body",
+    (
+        "{% define label %}b{% enddefine %}",
+        '{% compose "composed.html" takes_context %}{% endcompose %}',
+        '{% compose "composed.html" %}{% define label %}b{% enddefine %}'
+        "{% endcompose %}",
+    ),
+)
+def test_parallel_serial_fallback(body):
+    template = engines["django"].from_string(
+        "{% load compose %}{% parallel %}" + body + "{% endparallel %}"
+    )
+    assert not template.template.nodelist[-1].parallel
+
+
+def test_compose_graph():
+    engine = Engine(
+        loaders=[
+            (
+                "django.template.loaders.locmem.Loader",
+                {
+                    "page.html": '{% load compose %}{% compose "components/card.html" %}'
+                    '{% compose "./button.html" %}{% endcompose %}{% endcompose %}'
+                    "{% compose name %}{% endcompose %}",
+                    "components/card.html": '{% load compose %}{% compose "./button.html" %}'
+                    "{% endcompose %}",
+                    "components/button.html": "<button>{{ children }}</button>",
+                    "components/a.html": '{% load compose %}{% compose "./b.html" %}'
+                    "{% endcompose %}",
+                    "components/b.html": '{% load compose %}{% compose "./a.html" %}'
+                    "{% endcompose %}",
+                },
+            )
+        ],
+        libraries={"compose": "compose_tags.templatetags.compose"},
+    )
+    graph = build_graph(engine)
+    assert graph.edges["page.html"] == {"components/card.html", "button.html"}
+    assert graph.edges["components/card.html"] == {"components/button.html"}
+    assert graph.dynamic == {"page.html": 1}
+    assert set(graph.errors) == {"button.html"}
+    assert graph.find_cycles() == [
+        ["components/a.html", "components/b.html", "components/a.html"]
+    ]
+    assert graph.longest_chains(1) == [
+        ["page.html", "components/card.html", "components/button.html"]
+    ]
+
+
+def test_compose_graph_unreadable_files(tmp_path):
+    (tmp_path / "page.html").write_text("<p>{{ name }}</p>")
+    (tmp_path / "image.png").write_bytes(b"\x89PNG\r\n\x1a\n\xff\xfe")
+    (tmp_path / ".page.html.swp").write_bytes(b"\xff\xfe")
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".git" / "HEAD").write_text("ref: refs/heads/main")
+    engine = Engine(dirs=[str(tmp_path)])
+    graph = build_graph(engine)
+    assert graph.templates == {"page.html"}
+    assert set(graph.errors) == {"image.png"}
+    assert isinstance(graph.errors["image.png"], UnicodeDecodeError)
+
+
+@pytest.mark.parametrize(
+    "argv, run_main, serving",
+    (
+        (["gunicorn", "project.wsgi"], None, True),
+        (["manage.py", "runserver"], "true", True),
+        (["manage.py", "runserver", "--noreload"], None, True),
+        (["manage.py", "runserver"], None, False),
+        (["manage.py", "migrate"], None, False),
+        (["/usr/bin/django-admin", "shell"], None, False),
+    ),
+)
+def test_precompile_when_serving(argv, run_main, serving, monkeypatch):
+    precompiled = []
+    monkeypatch.setattr("sys.argv", argv)
+    if run_main is None:
+        monkeypatch.delenv("RUN_MAIN", raising=False)
+    else:
+        monkeypatch.setenv("RUN_MAIN", run_main)
+    monkeypatch.setattr(
+        "compose_tags.graph.precompile", lambda: precompiled.append(True)
+    )
+    with override_settings(COMPOSE_TAGS={"PRECOMPILE": True}):
+        apps.get_app_config("compose_tags").ready()
+    assert precompiled == ([True] if serving else [])
+
+
+def test_compose_precompile_command(capsys):
+    call_command("compose_precompile", chains=100)
+    out, err = capsys.readouterr()
+    assert "Cycle: composition/recursive.html -> composition/recursive.html" in out
+    assert (
+        "Depth 1: autotest/test_composition_args.html -> composition/button.html" in out
+    )
+    assert "Can't compile autotest_template_syntax_error/" in err
+
+
+def test_persistent_loader(tmp_path, monkeypatch):
+    template_name = "autotest/test_composition_slots.html"
+    with override_settings(COMPOSE_TAGS={"COMPILED_TEMPLATES_DIR": str(tmp_path)}):
+        expected = make_persistent_engine().get_template(template_name).render()
+        paths = list(tmp_path.iterdir())
+        assert paths
+
+        def compile_template(*args):
+            raise AssertionError("The template should be loaded from disk")
+
+        with monkeypatch.context() as m:
+            m.setattr("compose_tags.loaders.Template", compile_template)
+            engine = make_persistent_engine()
+            assert engine.get_template(template_name).render() == expected
+
+        # Files that can't be loaded fall back to compiling the template.
+        for path in paths:
+            path.write_bytes(b"corrupted")
+        engine = make_persistent_engine()
+        assert engine.get_template(template_name).render() == expected
+        assert all(path.read_bytes() != b"corrupted" for path in paths)
+
+        # Files not signed with the SECRET_KEY are never unpickled.
+        payloads = {path: path.read_bytes() for path in paths}
+        unpickled = []
+        with override_settings(SECRET_KEY="other"), monkeypatch.context() as m:
+            m.setattr(
+                "compose_tags.loaders.TemplateUnpickler",
+                lambda *args: unpickled.append(args),
+            )
+            engine = make_persistent_engine()
+            assert engine.get_template(template_name).render() == expected
+        assert not unpickled
+        assert all(path.read_bytes() != payloads[path] for path in paths)
+
+
+def test_persistent_loader_versions():
+    versions = make_persistent_engine().engine.template_loaders[0].versions
+    path = compose_tags.node.__file__
+    stat = os.stat(path)
+    try:
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        assert make_persistent_engine().engine.template_loaders[0].versions != versions
+    finally:
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def test_persistent_loader_directory(tmp_path):
+    directory = tmp_path / "compiled"
+    template_name = "autotest/test_composition_slots.html"
+    with override_settings(COMPOSE_TAGS={"COMPILED_TEMPLATES_DIR": str(directory)}):
+        make_persistent_engine().get_template(template_name)
+    assert directory.stat().st_mode & 0o777 == 0o700
+
+    with pytest.raises(ImproperlyConfigured):
+        make_persistent_engine().get_template(template_name)
+
+
+def test_minify():
+    source = (
+        "{% load compose %}\n"
+        '{% compose "composition/card.html" %}\n'
+        "    <p>\n        Hello\n        {{ name }}\n    </p>\n"
+        "    <ul>\n        <li><a>a</a>\n        <a>b</a></li>\n    </ul>\n"
+        "    <pre>\n  kept\n</pre>\n"
+        "    {% slot footer %}\n        <a>Footer</a>\n    {% endslot %}\n"
+        "{% endcompose %}\n"
+    )
+    with override_settings(COMPOSE_TAGS={"MINIFY": False}):
+        rendered = make_engine().from_string(source).render({"name": "a"})
+    with override_settings(COMPOSE_TAGS={"MINIFY": True}):
+        minified = make_engine().from_string(source).render({"name": "a"})
+    # Whitespace next to the compose and slot tags and to inline elements is kept.
+    assert minified == (
+        "\n<article><h1></h1> <p> Hello a </p><ul><li><a>a</a> <a>b</a></li></ul>"
+        "<pre>\n  kept\n</pre>  <footer> <a>Footer</a> </footer></article>\n"
+    )
+    assert len(minified) < len(rendered)
+
+
+def test_minify_composed_template_shared():
+    source = (
+        "{% load compose %}"
+        '{% compose "composed_array.html" list=items %}{% endcompose %}'
+    )
+    with override_settings(COMPOSE_TAGS={"MINIFY": True}):
+        engine = make_engine()
+        minified = engine.from_string(source).render({"items": ["a", "b"]})
+        rendered = engine.get_template("composed_array.html").render(
+            {"list": ["a", "b"]}
+        )
+    assert minified == " a  b "
+    assert rendered == "\n    a\n\n    b\n"
+
+
+def test_compose_constant_kwargs():
+    template = engines["django"].from_string(
+        '{% load compose i18n %}{% compose "composed.html" variant="primary" '
+        'size=2 flag=True title="a"|upper|add:"b" label=name|upper text=_("Text") '
+        'date="2022-01-01"|date %}{% endcompose %}'
+    )
+    node = template.template.nodelist[-1]
+    assert node.constant_context == {
+        "variant": "primary",
+        "size": 2,
+        "flag": True,
+        "title": "Ab",
+    }
+    assert set(node.variable_context) == {"label", "text", "date"}
+
+
+NESTED_COMPOSE = (
+    "{% load compose %}"
+    '{% compose "composition/card.html" title="a" %}'
+    '{% compose "composition/card.html" title="b" %}{{ label }}{% endcompose %}'
+    "{% endcompose %}"
+)
+NESTED_COMPOSE_OUTPUT = (
+    "<article><h1>a</h1><article><h1>b</h1>c<footer></footer></article>"
+    "<footer></footer></article>"
+)
+
+
+def test_children_allocations():
+    template = engines["django"].from_string(NESTED_COMPOSE).template
+    context = Context({"label": "c"})
+    assert template.render(context) == NESTED_COMPOSE_OUTPUT
+    allocations = get_children_allocations(context)
+    assert allocations.count == 2
+    assert allocations.size > len(NESTED_COMPOSE_OUTPUT)
+
+
+def test_unconditional_children_rendered_upfront():
+    template = engines["django"].from_string(
+        "{% load compose %}"
+        '{% compose "composition/card.html" %}a{% endcompose %}'
+        '{% compose "composition/conditional.html" takes_context %}b{% endcompose %}'
+    )
+    card_node, conditional_node = template.template.nodelist[1:]
+    context = Context()
+    with context.bind_template(template.template):
+        for node, eager in ((card_node, True), (conditional_node, False)):
+            values = node.get_render_context(context, node.get_template(context))
+            assert isinstance(values["children"], str) is eager
+            assert str(values["children"]) == ("a" if eager else "b")
+
+
+def test_render_chunks_joins_children_once():
+    template = engines["django"].from_string(NESTED_COMPOSE).template
+    context = Context({"label": "c"})
+    assert render_chunks(template, context) == NESTED_COMPOSE_OUTPUT
+    assert get_children_allocations(context).count == 0
+
+
+def test_children_budget(caplog):
+    template = engines["django"].from_string(NESTED_COMPOSE)
+    with override_settings(COMPOSE_TAGS={"CHILDREN_BUDGET": 1}):
+        assert template.render({"label": "c"}) == NESTED_COMPOSE_OUTPUT
+    assert [record.name for record in caplog.records] == ["compose_tags.children"]
+    with override_settings(
+        COMPOSE_TAGS={"CHILDREN_BUDGET": 1, "CHILDREN_BUDGET_ERROR": True}
+    ):
+        with pytest.raises(ChildrenBudgetExceeded):
+            template.render({"label": "c"})
+
+
+def test_render_many_composition_tag():
+    items = [{"title": "a", "footer": "<b>"}, {"footer": "c"}]
+    assert render_many(card, items, children=lambda item: item["footer"] * 2) == (
+        "<article><h1>a</h1>&lt;b&gt;&lt;b&gt;<footer>&lt;b&gt;</footer></article>"
+        "<article><h1>Title</h1>cc<footer>c</footer></article>"
+    )
+
+
+def test_render_many_template():
+    rendered = list(
+        iter_many(
+            "composition/button.html",
+            ({"disabled": i % 2} for i in range(3)),
+            children=mark_safe("<i>"),
+        )
+    )
+    assert rendered == [
+        "<button><i></button>",
+        "<button disabled><i></button>",
+        "<button><i></button>",
+    ]
+
+
+def test_render_many_takes_context():
+    rendered = render_many(takes_context, [{}, {}], context={"context_variable": "a"})
+    assert format_html(rendered) == "aa"
+
+
+def test_render_many_invalid():
+    with pytest.raises(TypeError):
+        render_many(object(), [{}])
+
+
+def test_fingerprint():
+    template = engines["django"].from_string(
+        "{% load composition_test %}"
+        "{% card footer=footer %}{{ label }}{% endcard %}"
+        "{% memoized_output %}{{ label }}{% endmemoized_output %}"
+    )
+
+    def render_fingerprint(**context):
+        with fingerprint() as page_fingerprint:
+            template.render(context)
+        assert page_fingerprint.components == 2
+        return page_fingerprint.hexdigest()
+
+    first = render_fingerprint(label="a", footer="b")
+    # The memoized output is reused, and fingerprinted the same.
+    assert render_fingerprint(label="a", footer="b") == first
+    assert render_fingerprint(label="a", footer="c") != first
+    assert render_fingerprint(label="b", footer="b") != first
+
+
+def test_etag_middleware(rf):
+    def view(request):
+        # Rendered with the request: the context has a CSRF token.
+        return HttpResponse(
+            render_to_string(
+                "autotest/test_compose_slots.html",
+                {"label": request.GET.get("label")},
+                request,
+            )
+        )
+
+    middleware = ComposeETagMiddleware(view)
+    response = middleware(rf.get("/"))
+    assert response.status_code == 200
+    etag = response["ETag"]
+    assert etag.startswith('"')
+    assert not response.has_header("Vary")
+    response = middleware(rf.get("/", HTTP_IF_NONE_MATCH=etag))
+    assert response.status_code == 304
+    response = middleware(rf.get("/?label=a", HTTP_IF_NONE_MATCH=etag))
+    assert response.status_code == 200
+    assert response["ETag"] != etag
+
+    # The output of the page also depends on the language, time zone and salt.
+    with translation.override("fr"):
+        response = middleware(rf.get("/", HTTP_IF_NONE_MATCH=etag))
+    assert response.status_code == 200
+    with timezone.override("Asia/Tokyo"):
+        response = middleware(rf.get("/", HTTP_IF_NONE_MATCH=etag))
+    assert response.status_code == 200
+    with override_settings(COMPOSE_TAGS={"ETAG_SALT": "v2"}):
+        response = middleware(rf.get("/", HTTP_IF_NONE_MATCH=etag))
+    assert response.status_code == 200
+
+
+def test_etag_middleware_templates_salt(rf, monkeypatch):
+    def view(request):
+        return HttpResponse(render_to_string("autotest/test_compose_slots.html"))
+
+    sources = [("page.html", "<main>{% block content %}{% endblock %}</main>")]
+    monkeypatch.setattr(
+        "compose_tags.middleware.iter_template_sources", lambda engine: sources
+    )
+    etag = ComposeETagMiddleware(view)(rf.get("/"))["ETag"]
+    assert ComposeETagMiddleware(view)(rf.get("/"))["ETag"] == etag
+    # A deploy changing a template the fingerprint can't see, e.g. the page's.
+    sources = [("page.html", "<main>{% block content %}{% endblock %}</main>!")]
+    assert ComposeETagMiddleware(view)(rf.get("/"))["ETag"] != etag
+
+
+def test_etag_middleware_unstable_values(rf):
+    template = engines["django"].from_string(
+        "{% load composition_test %}"
+        "{% card footer=article %}{{ article.title }}{% endcard %}"
+    )
+
+    def view(request):
+        return HttpResponse(template.render({"article": Article(1, "a")}, request))
+
+    response = ComposeETagMiddleware(view)(rf.get("/"))
+    assert response.status_code == 200
+    assert not response.has_header("ETag")
+
+
+def test_define_lazy_not_rendered_unless_used():
+    template = (
+        engines["django"]
+        .from_string(
+            "{% load compose %}{% define unused lazy %}{{ label }}{% enddefine %}"
+        )
+        .template
+    )
+    context = Context({"label": "a"})
+    assert template.render(context) == ""
+    assert context["unused"]._rendered is None
+    context["label"] = "b"
+    assert str(context["unused"]) == "a"
+
+
+def test_template_variables():
+    template = engines["django"].from_string(
+        "{% load compose i18n %}"
+        "{% for item in items %}{{ item.name|default:fallback }}{% endfor %}"
+        "{% if a and not b %}{% with c=d %}{{ c }}{% endwith %}{% endif %}"
+        "{% blocktranslate with e=f %}{{ e }} {{ g }}{% endblocktranslate %}"
+        '{% compose "composition/card.html" title=h %}{{ i }}{% endcompose %}'
+        "{% define j %}{{ k }}{% enddefine %}{{ True }}"
+    )
+    variables = get_template_variables(template.template)
+    assert variables.used == set("abcdefghik") | {
+        "items",
+        "item",
+        "fallback",
+        "True",
+        "csrf_token",
+    }
+    assert variables.bound == {"item", "forloop", "c", "e", "j"}
+    assert variables.get_missing(["a", "b"]) == set("dfghik") | {"items", "fallback"}
+
+    for source in (
+        '{% extends "composition/base.html" %}',
+        '{% include "composition/card.html" %}',
+        '{% load compose %}{% compose "composed.html" takes_context %}{% endcompose %}',
+        "{% load composition_test %}{% takes_context %}{% endtakes_context %}",
+    ):
+        assert (
+            get_template_variables(engines["django"].from_string(source).template)
+            is None
+        )
+    include = engines["django"].from_string('{% include "card.html" with a=b only %}')
+    assert get_template_variables(include.template).used == {"b"}
+
+    definelist = engines["django"].from_string(
+        "{% load compose %}"
+        "{% definelist rows for row in items %}{{ forloop.counter }}{% enddefinelist %}"
+    )
+    variables = get_template_variables(definelist.template)
+    assert variables.bound == {"rows", "row", "forloop"}
+    assert variables.get_missing([]) == {"items"}
+
+
+def test_default_composition_binds_arguments():
+    template = engines["django"].from_string(
+        "{% load composition_test %}"
+        '{% default_card title=name variant="a" %}c'
+        "{% slot footer %}f{% endslot %}{% enddefault_card %}"
+    )
+    node = template.template.nodelist[-1]
+    assert node.func is default_composition
+    assert template.render({"name": "b"}) == (
+        "<article><h1>b</h1>c<footer>f</footer></article>"
+    )
+    # Bound as is, without calling default_composition: children and slots are
+    # kept lazy.
+    values = node.call(*node.get_resolved_arguments(Context({"name": "b"})))
+    assert values["title"] == "b"
+    assert values["variant"] == "a"
+    assert not isinstance(values["children"], str)
+    assert not isinstance(values["footer"], str)
+
+
+def test_composition_binds_mixed_arguments():
+    template = engines["django"].from_string(
+        "{% load composition_test %}"
+        '{% mixed_arguments "a" name label=name|upper variant="v" %}c'
+        "{% slot extra %}x{% endslot %}{% endmixed_arguments %}"
+    )
+    for name in ("b", "c"):
+        assert template.render({"name": name}) == (
+            f"<article><h1>a</h1>c<footer>{name} {name} "
+            f"extra=x label={name.upper()} variant=v</footer></article>"
+        )
+
+
+def test_unread_arguments_not_resolved(caplog):
+    caplog.set_level("INFO", logger="compose_tags.analysis")
+    calls = []
+
+    def unused():
+        calls.append(True)
+        return "unused"
+
+    template = engines["django"].from_string(
+        "{% load compose composition_test %}"
+        '{% compose "composition/card.html" title=title unused=unused %}'
+        "c{% endcompose %}"
+        "{% test_csrf unused=unused %}{% endtest_csrf %}"
+    )
+    for _ in range(2):
+        assert template.render({"title": "a", "unused": unused}) == (
+            "<article><h1>a</h1>c<footer></footer></article>"
+        )
+    assert calls == []
+    # Logged once per node, when it selects its template.
+    assert [(record.levelname, record.getMessage()) for record in caplog.records] == [
+        (
+            "WARNING",
+            "<unknown source>, line 1 passes unused to composition/card.html, "
+            "which doesn't read them.",
+        ),
+        (
+            "INFO",
+            "composition/card.html reads footer, never passed by "
+            "<unknown source>, line 1.",
+        ),
+        (
+            "WARNING",
+            "<unknown source>, line 1 passes unused to composition/test_csrf.html, "
+            "which doesn't read them.",
+        ),
+    ]
+
+    # Templates that may read any variable receive all the arguments.
+    template = engines["django"].from_string(
+        "{% load compose %}"
+        '{% compose "composition/extends.html" unused=unused %}c{% endcompose %}'
+    )
+    assert template.render({"unused": unused}) == "<section>c</section>"
+    assert calls == [True]
@@ -0,0 +1,112 @@
+import os
+
+import pytest
+from django.template import engines
+
+from tests.templatetags.composition_test import card, memoized, takes_context
+
+jinja2 = pytest.importorskip("jinja2")
+
+from django.template.backends.jinja2 import Jinja2  # noqa: E402
+
+from compose_tags.jinja2 import ComposeExtension, composition_extension  # noqa: E402
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+
+
+@pytest.fixture
+def engine():
+    return Jinja2(
+        {
+            "NAME": "jinja2",
+            "DIRS": [
+                os.path.join(dir_path, "jinja2"),
+                os.path.join(dir_path, "templates"),
+            ],
+            "APP_DIRS": False,
+            "OPTIONS": {
+                "extensions": [
+                    ComposeExtension,
+                    composition_extension(card, memoized, takes_context),
+                ],
+            },
+        }
+    )
+
+
+def test_compose_as_django(engine):
+    django_template = engines["django"].from_string(
+        "{% load compose %}{% define footer %}<b>{{ label }}</b>{% enddefine %}"
+        '{% compose "composition/card.html" title=label footer=footer %}'
+        "{{ label }}{% endcompose %}"
+    )
+    template = engine.from_string(
+        "{% define footer %}<b>{{ label }}</b>{% enddefine %}"
+        '{% compose "composition/card.html" title=label footer=footer %}'
+        "{{ label }}{% endcompose %}"
+    )
+    context = {"label": "<a>"}
+    assert template.render(context) == django_template.render(context)
+    assert template.render(context) == (
+        "<article><h1>&lt;a&gt;</h1>&lt;a&gt;"
+        "<footer><b>&lt;a&gt;</b></footer></article>"
+    )
+
+
+def test_compose_isolation(engine):
+    template = engine.from_string(
+        '{% compose "composition/takes_context.html" %}{% endcompose %};'
+        '{% compose "composition/takes_context.html" takes_context %}{% endcompose %}'
+    )
+    assert template.render({"my_var": "a"}) == ";a"
+
+
+def test_compose_relative_path(engine):
+    template = engine.get_template("jinja2_relative.html")
+    assert template.render({"title": "a", "label": "b"}) == (
+        "<article><h1>a</h1>b<footer></footer></article>"
+    )
+
+
+def test_compose_lazy_children(engine):
+    template = engine.from_string(
+        '{% compose "composition/conditional.html" show=show %}'
+        "{{ raise_error() }}{% endcompose %}"
+    )
+
+    def raise_error():
+        raise AssertionError("Children should not be rendered")
+
+    assert template.render({"show": False, "raise_error": raise_error}) == ""
+
+
+def test_compose_csrf(engine, rf):
+    template = engine.from_string('{% compose "jinja2_csrf.html" %}{% endcompose %}')
+    assert "csrfmiddlewaretoken" in template.render({}, rf.get("/"))
+
+
+def test_composition_tags(engine):
+    template = engine.from_string(
+        '{% card footer="f" title=title %}{{ title }}{% endcard %}'
+        "{% memoized disabled=True %}b{% endmemoized %}"
+        "{% takes_context %}{% endtakes_context %}"
+    )
+    assert template.render({"title": "a", "context_variable": "c"}) == (
+        "<article><h1>a</h1>a<footer>f</footer></article>"
+        "<button disabled>b</button>c"
+    )
+
+
+@pytest.mark.parametrize(
+    "source",
+    (
+        "{% card %}{% endcard %}",
+        '{% card footer="f" subtitle="s" %}{% endcard %}',
+        '{% compose "composition/card.html" children="c" %}{% endcompose %}',
+        '{% compose "composition/card.html" title %}{% endcompose %}',
+        "{% define a b %}{% enddefine %}",
+    ),
+)
+def test_syntax_errors(engine, source):
+    with pytest.raises(jinja2.TemplateSyntaxError):
+        engine.from_string(source)